@@ -1,8 +1,13 @@
 from .nodes_legacy import MiniCPM_VQA
 from .nodes_polished import MiniCPM_VQA_Polished
+from .nodes_batch import MiniCPM_Batch_VQA
+from .nodes_video import MiniCPM_Long_Video_VQA
+from .nodes_session import MiniCPM_Chat_Session
+from .nodes_dataset import MiniCPM_Dataset_Caption
 from .image_nodes import MultipleImagesInput
 from .util_nodes import LoadVideo,PreviewVideo
 from .display_text_nodes import DisplayText
+from .preload import start_preload
 WEB_DIRECTORY = "./web"
 # A dictionary that contains all nodes you want to export with their names
 # NOTE: names should be globally unique
@@ -12,6 +17,10 @@ NODE_CLASS_MAPPINGS = {
     "MultipleImagesInput": MultipleImagesInput,
     "MiniCPM_VQA": MiniCPM_VQA,
     "MiniCPM_VQA_Polished": MiniCPM_VQA_Polished,
+    "MiniCPM_Batch_VQA": MiniCPM_Batch_VQA,
+    "MiniCPM_Long_Video_VQA": MiniCPM_Long_Video_VQA,
+    "MiniCPM_Chat_Session": MiniCPM_Chat_Session,
+    "MiniCPM_Dataset_Caption": MiniCPM_Dataset_Caption,
     "DisplayText": DisplayText,
 }
 
@@ -22,5 +31,12 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "MultipleImagesInput": "Multiple Images Input",
     "MiniCPM_VQA": "MiniCPM VQA",
     "MiniCPM_VQA_Polished": "MiniCPM VQA Polished",
+    "MiniCPM_Batch_VQA": "MiniCPM Batch VQA",
+    "MiniCPM_Long_Video_VQA": "MiniCPM Long Video VQA",
+    "MiniCPM_Chat_Session": "MiniCPM Chat Session",
+    "MiniCPM_Dataset_Caption": "MiniCPM Dataset Caption",
     "DisplayText": "Display Text",
-}
\ No newline at end of file
+}
+
+# opt-in: load the models listed in MINICPM_PRELOAD in the background
+start_preload()
@@ -0,0 +1,102 @@
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+from .generation_utils import patched_generate, throw_if_interrupted
+
+
+class VQARequest:
+    def __init__(self, msgs, sampling_params=None, max_slice_nums=None):
+        self.msgs = msgs
+        self.sampling_params = sampling_params or {}
+        self.max_slice_nums = max_slice_nums
+        self.result = None
+
+    def batch_key(self):
+        # requests can only share a `generate` call if they sample identically
+        return (tuple(sorted(self.sampling_params.items())), self.max_slice_nums)
+
+    def cost(self):
+        # cheap length proxy used to group similar sized prompts and limit padding
+        content = self.msgs[-1]["content"]
+        images = sum(1 for c in content if not isinstance(c, str))
+        text = sum(len(c) for c in content if isinstance(c, str))
+        return images, text
+
+
+def supports_batched_chat(model):
+    # MiniCPM-V 2.6 accepts a list of message lists, MiniCPM-Llama3-V 2.5 does not
+    return "max_slice_nums" in inspect.signature(model.chat).parameters
+
+
+class BatchEngine:
+    """Collects VQA requests and runs them through `model.chat` in padded batches.
+
+    Pending requests are grouped by sampling parameters and slice count, sorted
+    by prompt size inside each group and split into chunks of `batch_size`.
+    Models without batched chat support run the requests one by one.
+    """
+
+    def __init__(self, batch_size=8):
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def submit(self, request):
+        with self._lock:
+            self._pending.append(request)
+        return request
+
+    def flush(self, model, tokenizer):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return []
+
+        groups = OrderedDict()
+        for request in pending:
+            groups.setdefault(request.batch_key(), []).append(request)
+
+        batched = supports_batched_chat(model)
+        start = time.perf_counter()
+        with patched_generate(model):  # stops at a queue interrupt
+            for requests in groups.values():
+                requests = sorted(requests, key=VQARequest.cost)
+                size = self.batch_size if batched else 1
+                for i in range(0, len(requests), size):
+                    self._run_batch(model, tokenizer, requests[i : i + size], batched)
+                    throw_if_interrupted()
+        elapsed = time.perf_counter() - start
+        print(
+            f"Batch VQA: {len(pending)} requests in {elapsed:.2f}s "
+            f"({len(pending) / max(elapsed, 1e-6):.2f} requests/s)"
+        )
+        return pending
+
+    def _run_batch(self, model, tokenizer, requests, batched):
+        params = dict(requests[0].sampling_params)
+        if requests[0].max_slice_nums is not None:
+            params.update(use_image_id=False, max_slice_nums=requests[0].max_slice_nums)
+
+        if batched:
+            results = model.chat(
+                image=None,
+                msgs=[request.msgs for request in requests],
+                tokenizer=tokenizer,
+                sampling=True,
+                **params,
+            )
+        else:
+            results = [
+                model.chat(
+                    image=None,
+                    msgs=request.msgs,
+                    tokenizer=tokenizer,
+                    sampling=True,
+                    **params,
+                )
+                for request in requests
+            ]
+        for request, result in zip(requests, results):
+            request.result = result
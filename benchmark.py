@@ -0,0 +1,468 @@
+"""Benchmark the VQA node outside of ComfyUI.
+
+Runs `MiniCPM_VQA_Polished.inference` on image, multi-image, video and
+text-only requests and prints per-stage timings (download check, tokenizer
+load, model load, video decode, preprocessing, generation, teardown), peak
+RSS/VRAM and tokens/sec as JSON. Image requests run once per
+`--image-preprocess` mode and report the preprocessing cost in ms per
+megapixel, so the tensor and PIL paths can be compared.
+
+By default the model is replaced by a tiny stub so the harness runs on a CPU
+in seconds and only measures the node's own overhead; `--real` loads the
+actual checkpoint (downloading it into `--models-dir` if needed).
+
+    python benchmark.py --repeat 3 --output bench.json
+    python benchmark.py --real --device-mode cpu --scenarios image text
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import math
+import os
+import resource
+import sys
+import tempfile
+import types
+
+import torch
+
+PACKAGE = "minicpm_nodes"
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ["image", "multi_image", "video", "text"]
+IMAGE_PREPROCESS = ["tensor", "tensor_gpu", "pil"]
+
+
+def install_folder_paths(models_dir):
+    """Stand-in for ComfyUI's `folder_paths` module."""
+    module = types.ModuleType("folder_paths")
+    module.models_dir = models_dir
+    module.get_input_directory = lambda: models_dir
+    module.get_output_directory = lambda: models_dir
+    module.get_temp_directory = lambda: models_dir
+    sys.modules["folder_paths"] = module
+
+
+def import_package():
+    # only the node modules are needed, the package __init__ pulls in ComfyUI
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [ROOT]
+    package.__spec__ = importlib.util.spec_from_loader(PACKAGE, None, is_package=True)
+    sys.modules[PACKAGE] = package
+    return {
+        name: importlib.import_module(f"{PACKAGE}.{name}")
+        for name in ["model_registry", "nodes_polished", "profiling", "provisioning"]
+    }
+
+
+class StubTokenizer:
+    def encode(self, text, add_special_tokens=True):
+        return [hash(word) % 32000 for word in text.split()]
+
+    def decode(self, ids, skip_special_tokens=False):
+        return " ".join(f"tok{i}" for i in ids)
+
+    def convert_tokens_to_ids(self, token):
+        return 0
+
+
+class StubLLM(torch.nn.Module):
+    """Emits `max_new_tokens` tokens, one small matmul per token."""
+
+    def __init__(self, hidden_size):
+        super().__init__()
+        self.proj = torch.nn.Linear(hidden_size, hidden_size)
+        # the fields the auto budget estimates memory from
+        self.config = types.SimpleNamespace(
+            hidden_size=hidden_size,
+            num_attention_heads=4,
+            num_hidden_layers=2,
+            intermediate_size=4 * hidden_size,
+            vocab_size=32000,
+        )
+
+    def generate(self, inputs_embeds, max_new_tokens=32, stopping_criteria=None, **kwargs):
+        state = inputs_embeds.mean(dim=1)
+        ids = torch.zeros((1, 0), dtype=torch.long)
+        for _ in range(max_new_tokens):
+            state = torch.tanh(self.proj(state))
+            token = state.argmax(dim=-1, keepdim=True)
+            ids = torch.cat([ids, token], dim=1)
+            if stopping_criteria and all(c(ids, None).all() for c in stopping_criteria):
+                break
+        return ids
+
+
+class StubImageProcessor:
+    """PIL slicing and normalization of MiniCPM-V 2.6's `MiniCPMVImageProcessor`.
+
+    Same methods and defaults as the checkpoint's processor, so the stub model
+    exercises both the `pil` path and the torch port of `image_preprocess`.
+    """
+
+    def __init__(self, max_slice_nums=9, scale_resolution=448, patch_size=14):
+        self.max_slice_nums = max_slice_nums
+        self.scale_resolution = scale_resolution
+        self.patch_size = patch_size
+        self.slice_mode = True
+        self.mean = [0.5, 0.5, 0.5]
+        self.std = [0.5, 0.5, 0.5]
+
+    def ensure_divide(self, length, patch_size):
+        return max(round(length / patch_size) * patch_size, patch_size)
+
+    def find_best_resize(self, original_size, scale_resolution, patch_size, allow_upscale=False):
+        width, height = original_size
+        if (width * height > scale_resolution * scale_resolution) or allow_upscale:
+            r = width / height
+            height = int(scale_resolution / math.sqrt(r))
+            width = int(height * r)
+        return (self.ensure_divide(width, patch_size), self.ensure_divide(height, patch_size))
+
+    def get_refine_size(self, original_size, grid, scale_resolution, patch_size, allow_upscale=False):
+        width, height = original_size
+        grid_x, grid_y = grid
+        refine_width = self.ensure_divide(width, grid_x)
+        refine_height = self.ensure_divide(height, grid_y)
+        best_grid_size = self.find_best_resize(
+            (refine_width / grid_x, refine_height / grid_y),
+            scale_resolution,
+            patch_size,
+            allow_upscale=allow_upscale,
+        )
+        return (best_grid_size[0] * grid_x, best_grid_size[1] * grid_y)
+
+    def get_sliced_grid(self, image_size, max_slice_nums, never_split=False):
+        width, height = image_size
+        log_ratio = math.log(width / height)
+        ratio = width * height / (self.scale_resolution * self.scale_resolution)
+        multiple = min(math.ceil(ratio), max_slice_nums)
+        if multiple <= 1 or never_split:
+            return None
+        candidate_grids = [
+            [m, n // m]
+            for n in [multiple - 1, multiple, multiple + 1]
+            if n != 1 and n <= max_slice_nums
+            for m in range(1, n + 1)
+            if n % m == 0
+        ]
+        return min(candidate_grids, key=lambda grid: abs(log_ratio - math.log(grid[0] / grid[1])))
+
+    def get_sliced_images(self, image, max_slice_nums=None):
+        from PIL import Image
+
+        if not self.slice_mode:
+            return [image]
+        max_slice_nums = self.max_slice_nums if max_slice_nums is None else int(max_slice_nums)
+        best_grid = self.get_sliced_grid(image.size, max_slice_nums)
+        if best_grid is None:
+            best_size = self.find_best_resize(
+                image.size, self.scale_resolution, self.patch_size, allow_upscale=True
+            )
+            return [image.resize(best_size, resample=Image.Resampling.BICUBIC)]
+        best_resize = self.find_best_resize(image.size, self.scale_resolution, self.patch_size)
+        source = image.resize(best_resize, resample=Image.Resampling.BICUBIC)
+        refine_size = self.get_refine_size(
+            image.size, best_grid, self.scale_resolution, self.patch_size, allow_upscale=True
+        )
+        refine = image.resize(refine_size, resample=Image.Resampling.BICUBIC)
+        grid_x = int(refine_size[0] / best_grid[0])
+        grid_y = int(refine_size[1] / best_grid[1])
+        patches = [
+            refine.crop((j, i, j + grid_x, i + grid_y))
+            for i in range(0, refine_size[1], grid_y)
+            for j in range(0, refine_size[0], grid_x)
+        ]
+        return [source] + patches
+
+    def reshape_by_patch(self, image):
+        patch_size = self.patch_size
+        patches = torch.nn.functional.unfold(image, (patch_size, patch_size), stride=(patch_size, patch_size))
+        patches = patches.reshape(image.size(0), patch_size, patch_size, -1)
+        return patches.permute(0, 1, 3, 2).reshape(image.size(0), patch_size, -1)
+
+    def preprocess(self, images, do_pad=True, max_slice_nums=None, return_tensors=None, **kwargs):
+        import numpy as np
+
+        mean = np.array(self.mean, dtype=np.float32)
+        std = np.array(self.std, dtype=np.float32)
+        pixel_values_list, image_sizes_list, tgt_sizes_list = [], [], []
+        for _images in images:
+            pixel_values, tgt_sizes = [], []
+            for image in _images or []:
+                for slice_image in self.get_sliced_images(image.convert("RGB"), max_slice_nums):
+                    array = (np.asarray(slice_image, dtype=np.float32) / 255 - mean) / std
+                    slice_tensor = torch.from_numpy(array.transpose(2, 0, 1).copy())
+                    pixel_values.append(self.reshape_by_patch(slice_tensor))
+                    tgt_sizes.append(
+                        (slice_tensor.shape[1] // self.patch_size, slice_tensor.shape[2] // self.patch_size)
+                    )
+            pixel_values_list.append(pixel_values)
+            image_sizes_list.append([image.size for image in _images or []])
+            tgt_sizes_list.append(torch.tensor(tgt_sizes, dtype=torch.int32) if tgt_sizes else [])
+        return {
+            "pixel_values": pixel_values_list,
+            "image_sizes": image_sizes_list,
+            "tgt_sizes": tgt_sizes_list,
+        }
+
+
+class StubProcessor:
+    def __init__(self):
+        self.image_processor = StubImageProcessor()
+
+
+class StubModel(torch.nn.Module):
+    """Mimics the parts of MiniCPM-V's `chat` API the nodes rely on."""
+
+    def __init__(self, hidden_size=256):
+        super().__init__()
+        self.vision = torch.nn.Conv2d(3, hidden_size, kernel_size=14, stride=14)
+        self.llm = StubLLM(hidden_size)
+        self.config = types.SimpleNamespace(query_num=64)
+        self.terminators = ["</s>"]
+        # images are sliced by the same processor API as MiniCPM-V 2.6's
+        self.processor = StubProcessor()
+
+    @property
+    def device(self):
+        return self.llm.proj.weight.device
+
+    @property
+    def dtype(self):
+        return self.llm.proj.weight.dtype
+
+    @property
+    def hidden_size(self):
+        return self.llm.proj.in_features
+
+    def get_vllm_embedding(self, data):
+        # one hidden state per slice, from its (3, patch, patches * patch) pixel values
+        vision_hidden_states = [
+            self.vision(pixels.to(self.dtype).unsqueeze(0)).flatten(2).mean(-1)
+            for pixels in data["pixel_values"]
+        ]
+        vision_hidden_states = (
+            torch.cat(vision_hidden_states)
+            if vision_hidden_states
+            else torch.zeros((0, self.hidden_size))
+        )
+        embeds = torch.cat([vision_hidden_states, data["text_embeds"]]).unsqueeze(0)
+        return embeds, [vision_hidden_states]
+
+    def chat(
+        self,
+        image,
+        msgs,
+        tokenizer,
+        vision_hidden_states=None,
+        max_new_tokens=32,
+        stream=False,
+        max_slice_nums=None,
+        **kwargs,
+    ):
+        images, text = [], []
+        for c in msgs[-1]["content"]:
+            if isinstance(c, str):
+                text.append(c)
+            else:
+                images.append(c)
+        ids = torch.tensor(tokenizer.encode(" ".join(text)) or [0])
+        text_embeds = torch.nn.functional.one_hot(
+            ids % self.hidden_size, self.hidden_size
+        ).float()
+        if vision_hidden_states is not None:
+            embeds = torch.cat([vision_hidden_states[0], text_embeds]).unsqueeze(0)
+        else:
+            pixel_values = []
+            if images:
+                stage = importlib.import_module(f"{PACKAGE}.profiling").stage
+                with stage("image_processing"):
+                    pixel_values = self.processor.image_processor.preprocess(
+                        [images], max_slice_nums=max_slice_nums
+                    )["pixel_values"][0]
+            embeds, _ = self.get_vllm_embedding(
+                {"pixel_values": pixel_values, "text_embeds": text_embeds}
+            )
+        output = self.llm.generate(
+            inputs_embeds=embeds,
+            max_new_tokens=min(max_new_tokens, 64),
+            stopping_criteria=kwargs.get("stopping_criteria"),
+        )
+        answer = tokenizer.decode(output[0].tolist())
+        if stream:
+            return iter(answer.split(" "))
+        return answer
+
+
+def install_stub_model(modules):
+    model_registry = modules["model_registry"]
+    stage = modules["profiling"].stage
+
+    def load(key, model_checkpoint, torch_dtype, attn_implementation, device_mode):
+        with stage("tokenizer_load"):
+            tokenizer = StubTokenizer()
+        with stage("model_load"):
+            model = StubModel().eval()
+        size = sum(p.numel() * p.element_size() for p in model.parameters())
+        return model_registry.ModelEntry(key, model, tokenizer, size)
+
+    model_registry.registry._load = load
+
+
+def synthetic_video(path, seconds=8, fps=24, size=(640, 360)):
+    """Write a moving gradient clip, returns None without a video encoder."""
+    try:
+        from torchvision.io import write_video
+    except ImportError:
+        return None
+    width, height = size
+    shape = (seconds * fps, height, width, 1)
+    t = torch.arange(seconds * fps, dtype=torch.float32).view(-1, 1, 1, 1)
+    x = torch.linspace(0, 1, width).view(1, 1, width, 1)
+    y = torch.linspace(0, 1, height).view(1, height, 1, 1)
+    frames = torch.cat(
+        [
+            (x + t / fps).remainder(1).expand(shape),
+            (y + t / 50).remainder(1).expand(shape),
+            (x * y).expand(shape),
+        ],
+        dim=-1,
+    )
+    try:
+        write_video(path, frames.mul(255).to(torch.uint8), fps=fps)
+    except Exception as e:
+        print("Could not write a synthetic video:", e, file=sys.stderr)
+        return None
+    return path
+
+
+def scenario_inputs(name, args, workdir):
+    image = torch.rand((1, 720, 1280, 3))
+    if name == "image":
+        return {"source_image_path": image}
+    if name == "multi_image":
+        return {"source_image_path": image.repeat(3, 1, 1, 1)}
+    if name == "video":
+        path = args.video or synthetic_video(os.path.join(workdir, "synthetic.mp4"))
+        return None if path is None else {"source_video_path": path}
+    return {}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024**2 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def megapixels(inputs):
+    images = inputs.get("source_image_path")
+    return 0 if images is None else images.shape[0] * images.shape[1] * images.shape[2] / 1e6
+
+
+def run_scenario(node, name, inputs, args, image_preprocess):
+    output = node.inference(
+        text="Describe this in detail.",
+        model=args.model,
+        keep_model_loaded=args.keep_model_loaded,
+        top_p=0.8,
+        top_k=100,
+        temperature=0.7,
+        repetition_penalty=1.05,
+        max_new_tokens=args.max_new_tokens,
+        video_max_num_frames=args.video_max_num_frames,
+        video_max_slice_nums=2,
+        seed=-1,  # a fixed seed would be answered from the response cache
+        device_mode=args.device_mode,
+        image_preprocess=image_preprocess,
+        budget=args.budget,
+        **inputs,
+    )
+    answer, metrics = output["result"]
+    result = {"scenario": name, **json.loads(metrics)}
+    mp = megapixels(inputs)
+    if mp:
+        # node side conversion plus the processor's slicing and normalization
+        stages = result["stages"]
+        seconds = stages.get("preprocess", 0) + stages.get("image_processing", 0)
+        result["image_preprocess"] = image_preprocess
+        result["megapixels"] = round(mp, 3)
+        result["ms_per_megapixel"] = round(seconds * 1000 / mp, 2)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    result["answer_chars"] = len(answer)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--real", action="store_true", help="load the real checkpoint")
+    parser.add_argument("--model", default="MiniCPM-V-2_6-int4")
+    parser.add_argument("--models-dir", help="ComfyUI models directory (default: temporary)")
+    parser.add_argument("--device-mode", default="cpu", choices=["auto", "gpu", "sequential_offload", "cpu"])
+    parser.add_argument(
+        "--image-preprocess",
+        nargs="+",
+        default=IMAGE_PREPROCESS,
+        choices=IMAGE_PREPROCESS,
+        help="image preprocessing modes to compare on the image scenarios",
+    )
+    parser.add_argument("--budget", default="fixed", choices=["fixed", "auto"])
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--video", help="video file for the video scenario (default: synthetic)")
+    parser.add_argument("--video-max-num-frames", type=int, default=16)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--keep-model-loaded", action="store_true")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        models_dir = args.models_dir or workdir
+        install_folder_paths(models_dir)
+        # repeated images would skip preprocessing through cached vision embeddings
+        os.environ.setdefault("MINICPM_VISION_CACHE_MB", "0")
+        modules = import_package()
+        if not args.real:
+            install_stub_model(modules)
+            for name in [args.model, args.model.replace("-int4", "")]:
+                checkpoint = os.path.join(models_dir, "prompt_generator", name)
+                os.makedirs(checkpoint, exist_ok=True)
+                # an empty, complete manifest keeps the downloader offline
+                modules["provisioning"].write_manifest(checkpoint, {"complete": True, "files": {}})
+
+        node = modules["nodes_polished"].MiniCPM_VQA_Polished()
+        runs = []
+        for name in args.scenarios:
+            inputs = scenario_inputs(name, args, workdir)
+            if inputs is None:
+                runs.append({"scenario": name, "skipped": "no video encoder available"})
+                continue
+            # only image inputs depend on the preprocessing mode
+            modes = args.image_preprocess if megapixels(inputs) else args.image_preprocess[:1]
+            for mode in modes:
+                for _ in range(args.repeat):
+                    runs.append(run_scenario(node, name, inputs, args, mode))
+
+    report = {
+        "model": args.model,
+        "stub": not args.real,
+        "device_mode": args.device_mode,
+        "budget": args.budget,
+        "torch": torch.__version__,
+        "runs": runs,
+        "ms_per_megapixel": {
+            mode: round(sum(costs) / len(costs), 2)
+            for mode in args.image_preprocess
+            if (costs := [r["ms_per_megapixel"] for r in runs if r.get("image_preprocess") == mode])
+        },
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .model_registry import registry
+from .kv_generation import cache_nbytes
+
+
+class ChatSession:
+    """Conversation handle passed between nodes as the SESSION type.
+
+    It only holds the message history; the key/value cache of the conversation
+    lives in `session_store` under `session_id`, so a session whose cache was
+    evicted still works, it just prefills its whole history again.
+    """
+
+    def __init__(self, session_id=None, messages=()):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.messages = list(messages)
+
+    def extend(self, user_content, answer):
+        # a new handle per turn keeps upstream node outputs unchanged
+        return ChatSession(
+            self.session_id,
+            self.messages
+            + [
+                {"role": "user", "content": user_content},
+                {"role": "assistant", "content": [answer]},
+            ],
+        )
+
+
+class SessionState:
+    def __init__(self, model_entry, cache, token_ids):
+        self.model_entry = model_entry
+        self.cache = cache
+        self.token_ids = token_ids
+        self.size = cache_nbytes(cache)
+        self.last_used = time.monotonic()
+
+
+class SessionStore:
+    """Bounded store of the key/value caches of active chat sessions.
+
+    Caches idle for more than `idle_timeout` seconds are dropped by a timer,
+    and the least recently used ones when the total exceeds `max_bytes`. All
+    caches of a model are dropped when it is unloaded.
+    """
+
+    def __init__(self, max_bytes, idle_timeout):
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @classmethod
+    def from_env(cls):
+        max_mb = float(os.environ.get("MINICPM_SESSION_CACHE_MB", 2048))
+        idle_timeout = float(os.environ.get("MINICPM_SESSION_IDLE_TIMEOUT", 600))
+        return cls(int(max_mb * 1024**2), idle_timeout)
+
+    def take(self, session_id, model_entry):
+        """Remove and return the state of `session_id` if it belongs to `model_entry`."""
+        with self._lock:
+            state = self._states.pop(session_id, None)
+        if state is not None and state.model_entry is not model_entry:
+            return None
+        return state
+
+    def put(self, session_id, state):
+        with self._lock:
+            self._states[session_id] = state
+            self._drop_idle()
+            total = sum(s.size for s in self._states.values())
+            while total > self.max_bytes and self._states:
+                _, old = self._states.popitem(last=False)
+                total -= old.size
+            self._schedule_sweep()
+
+    def _drop_idle(self):
+        now = time.monotonic()
+        for key, old in list(self._states.items()):
+            if now - old.last_used > self.idle_timeout:
+                del self._states[key]
+
+    def _sweep(self):
+        # abandoned sessions must not keep their caches on the GPU until the next turn
+        with self._lock:
+            self._timer = None
+            self._drop_idle()
+            self._schedule_sweep()
+
+    def _schedule_sweep(self):
+        if self._timer is not None or not self._states or self.idle_timeout <= 0:
+            return
+        oldest = min(s.last_used for s in self._states.values())
+        delay = max(oldest + self.idle_timeout - time.monotonic(), 0) + 1
+        self._timer = threading.Timer(delay, self._sweep)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def drop_model(self, model_entry):
+        with self._lock:
+            for key, state in list(self._states.items()):
+                if state.model_entry is model_entry:
+                    del self._states[key]
+
+
+session_store = SessionStore.from_env()
+registry.add_unload_listener(session_store.drop_model)
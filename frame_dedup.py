@@ -0,0 +1,49 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# frames are compared as grayscale thumbnails of this size
+THUMBNAIL_SIZE = 32
+
+
+def distinct_frames(thumbs, threshold, temporal=True):
+    """Indices of `thumbs` left after dropping near-duplicates, in order.
+
+    `thumbs` is an (N, H, W) array in [0, 1]. The similarity of two frames is
+    one minus their mean absolute difference; a frame at least `threshold`
+    similar to the previously kept frame (`temporal`, for video) or to any
+    kept frame (for image sets) is dropped. The first frame is always kept.
+    """
+    if threshold <= 0 or len(thumbs) < 2:
+        return list(range(len(thumbs)))
+    kept = [0]
+    for i in range(1, len(thumbs)):
+        reference = thumbs[kept[-1:]] if temporal else thumbs[kept]
+        difference = np.abs(reference - thumbs[i]).mean(axis=(1, 2)).min()
+        if 1 - difference < threshold:
+            kept.append(i)
+    return kept
+
+
+def image_thumbs(images):
+    """Grayscale thumbnails of a ComfyUI IMAGE batch (BHWC float in [0, 1])."""
+    gray = images.float().mean(dim=-1, keepdim=True).permute([0, 3, 1, 2])
+    thumbs = F.interpolate(gray, size=(THUMBNAIL_SIZE, THUMBNAIL_SIZE), mode="area")
+    return thumbs[:, 0].cpu().numpy()
+
+
+def dedup_image_batches(image_batches, threshold):
+    """Drop near-duplicate images across `image_batches`, returns (batches, number pruned)."""
+    if threshold <= 0 or not image_batches:
+        return image_batches, 0
+    thumbs = np.concatenate([image_thumbs(batch) for batch in image_batches])
+    kept = set(distinct_frames(thumbs, threshold, temporal=False))
+    result, start = [], 0
+    for batch in image_batches:
+        indices = [i - start for i in range(start, start + len(batch)) if i in kept]
+        start += len(batch)
+        if len(indices) == len(batch):
+            result.append(batch)
+        elif indices:
+            result.append(batch[torch.tensor(indices)])
+    return result, len(thumbs) - len(kept)
@@ -0,0 +1,205 @@
+from contextlib import contextmanager
+
+import torch
+from .profiling import stage, increment
+
+
+@contextmanager
+def patched_generate(model, **extra_kwargs):
+    """Merge `extra_kwargs` into every `model.llm.generate` call made in the block.
+
+    `model.chat` only forwards its own sampling parameters to the language
+    model, so anything else (stopping criteria, assistant models, ...) has to
+    be injected here. Stopping criteria are appended to any existing ones.
+    The prompt length of each call is counted as `prompt_tokens`.
+
+    Generation also stops when the ComfyUI queue is interrupted, and the block
+    then raises ComfyUI's interrupt exception instead of returning a cut
+    short answer.
+    """
+    from transformers import StoppingCriteriaList
+
+    extra_kwargs = dict(extra_kwargs)
+    extra_kwargs["stopping_criteria"] = StoppingCriteriaList(
+        [*extra_kwargs.get("stopping_criteria", []), *interrupt_criteria()]
+    )
+    llm = model.llm
+    previous = llm.__dict__.get("generate")
+    generate = llm.generate
+
+    def generate_with_extra_kwargs(*args, **kwargs):
+        prompt = kwargs.get("inputs_embeds", kwargs.get("input_ids"))
+        if prompt is not None:
+            increment("prompt_tokens", prompt.shape[0] * prompt.shape[1])
+        for key, value in extra_kwargs.items():
+            if key == "stopping_criteria" and kwargs.get(key) is not None:
+                kwargs[key] = StoppingCriteriaList([*kwargs[key], *value])
+            else:
+                kwargs[key] = value
+        return generate(*args, **kwargs)
+
+    llm.generate = generate_with_extra_kwargs
+    try:
+        yield
+    finally:
+        if previous is None:
+            del llm.generate
+        else:
+            llm.generate = previous
+    throw_if_interrupted()
+
+
+class InterruptCriteria:
+    """Stop generating once the ComfyUI queue is interrupted (same protocol as below)."""
+
+    def __init__(self, model_management):
+        self.model_management = model_management
+
+    def __call__(self, input_ids, scores, **kwargs):
+        interrupted = self.model_management.processing_interrupted()
+        return torch.full(
+            (input_ids.shape[0],), interrupted, dtype=torch.bool, device=input_ids.device
+        )
+
+
+def interrupt_criteria():
+    try:
+        import comfy.model_management
+    except ImportError:  # outside of ComfyUI, e.g. benchmark.py
+        return []
+    return [InterruptCriteria(comfy.model_management)]
+
+
+def throw_if_interrupted():
+    try:
+        import comfy.model_management
+    except ImportError:
+        return
+    comfy.model_management.throw_exception_if_processing_interrupted()
+
+
+class StopStringCriteria:
+    """Stop generating once `stop_string` appears in the newly generated text.
+
+    Implements the `transformers.StoppingCriteria` call protocol without
+    subclassing it, so importing this module does not import transformers.
+    """
+
+    def __init__(self, tokenizer, stop_string, prompt_length=0):
+        self.tokenizer = tokenizer
+        self.stop_string = stop_string
+        # `generate` called with `input_ids` (not only `inputs_embeds`) returns
+        # the prompt too, which must not be matched
+        self.prompt_length = prompt_length
+        # every token decodes to at least one character, so this window is enough
+        self.window = len(stop_string) + 8
+
+    def __call__(self, input_ids, scores, **kwargs):
+        start = max(self.prompt_length, input_ids.shape[1] - self.window)
+        done = [
+            self.stop_string in self.tokenizer.decode(ids[start:], skip_special_tokens=True)
+            for ids in input_ids
+        ]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class CallbackStreamer:
+    """`transformers` streamer calling `on_text` with each newly decoded piece of the answer.
+
+    Only the tokens since the last emitted text are decoded, together with the
+    token before them for context (spaces and merges depend on it), so every
+    token costs the same however long the answer gets.
+    """
+
+    def __init__(self, tokenizer, on_text):
+        self.tokenizer = tokenizer
+        self.on_text = on_text
+        self.token_ids = None  # the first `put` is the prompt
+        self.prefix_offset = 0  # start of the context tokens
+        self.read_offset = 0  # start of the tokens not emitted yet
+
+    def _decode(self, ids):
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def _emit(self, final=False):
+        ids = self.token_ids
+        prefix = self._decode(ids[self.prefix_offset : self.read_offset])
+        text = self._decode(ids[self.prefix_offset :])
+        # an incomplete multi-byte character decodes to U+FFFD, wait for the rest of it
+        if len(text) > len(prefix) and (final or not text.endswith("\ufffd")):
+            self.on_text(text[len(prefix) :])
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(ids)
+
+    def put(self, value):
+        if self.token_ids is None:
+            self.token_ids = []
+            return
+        self.token_ids.extend(value.reshape(-1).tolist())
+        self._emit()
+
+    def end(self):
+        if self.token_ids:
+            self._emit(final=True)
+
+
+def frontend_streamer(unique_id):
+    """Return a callback that pushes new text of node `unique_id` to the browser.
+
+    The first message of a run replaces the displayed text, later ones are
+    appended to it.
+    """
+    from server import PromptServer
+
+    started = False
+
+    def send(text):
+        nonlocal started
+        PromptServer.instance.send_sync(
+            "minicpm.stream", {"node": unique_id, "text": text, "append": started}
+        )
+        started = True
+
+    return send
+
+
+def run_chat(model, tokenizer, msgs, stream=False, stop_string="", on_text=None, **kwargs):
+    """Run `model.chat`, optionally streaming each new piece of text to `on_text`.
+
+    Generation ends early when `stop_string` is produced and the answer is cut
+    right before it.
+    """
+    extra_kwargs = {}
+    if stop_string:
+        from transformers import StoppingCriteriaList
+
+        extra_kwargs["stopping_criteria"] = StoppingCriteriaList(
+            [StopStringCriteria(tokenizer, stop_string)]
+        )
+
+    with stage("generate"), patched_generate(model, **extra_kwargs):
+        if not stream:
+            result = model.chat(
+                image=None, msgs=msgs, tokenizer=tokenizer, sampling=True, **kwargs
+            )
+        else:
+            result = ""
+            for text in model.chat(
+                image=None,
+                msgs=msgs,
+                tokenizer=tokenizer,
+                sampling=True,
+                stream=True,
+                **kwargs,
+            ):
+                result += text
+                if on_text is not None:
+                    on_text(text)
+                if stop_string and stop_string in result:
+                    break
+                throw_if_interrupted()
+
+    if stop_string:
+        result = result.split(stop_string)[0]
+    increment("generated_tokens", len(tokenizer.encode(result, add_special_tokens=False)))
+    return result
@@ -1,30 +1,84 @@
+import torch
+
+
+def combine_images(images):
+    """Concatenate IMAGE batches into one preallocated batch of the first one's size.
+
+    Like ComfyUI's ImageBatch, other sizes are resized (bilinear, center crop),
+    one `common_upscale` call per distinct size.
+    """
+    import comfy.utils
+
+    _, height, width, channels = images[0].shape
+    out = torch.empty(
+        (sum(image.shape[0] for image in images), height, width, channels),
+        dtype=images[0].dtype,
+        device=images[0].device,
+    )
+    offsets = []
+    offset = 0
+    for image in images:
+        offsets.append(offset)
+        offset += image.shape[0]
+
+    groups = {}
+    for image, offset in zip(images, offsets):
+        if image.shape[-1] != channels:
+            image = (
+                image[..., :channels]
+                if image.shape[-1] > channels
+                else torch.nn.functional.pad(image, (0, channels - image.shape[-1]), value=1.0)
+            )
+        if image.shape[1:3] == (height, width):
+            out[offset : offset + image.shape[0]] = image
+        else:
+            groups.setdefault(image.shape[1:3], []).append((image, offset))
+
+    for group in groups.values():
+        resized = comfy.utils.common_upscale(
+            torch.cat([image for image, _ in group]).movedim(-1, 1),
+            width,
+            height,
+            "bilinear",
+            "center",
+        ).movedim(1, -1)
+        start = 0
+        for image, offset in group:
+            n = image.shape[0]
+            out[offset : offset + n] = resized[start : start + n]
+            start += n
+    return out
+
+
 class MultipleImagesInput:
     @classmethod
     def INPUT_TYPES(s):
         return {
             "required": {
                 "inputcount": ("INT", {"default": 2, "min": 2, "max": 1000, "step": 1}),
+                # a widget, not the links, so ComfyUI's output cache sees the choice
+                "output": (["batch", "list"], {"default": "batch"}),
                 "image_1": ("IMAGE",),
                 "image_2": ("IMAGE",),
             },
         }
 
-    RETURN_TYPES = ("IMAGE",)
-    RETURN_NAMES = ("images",)
+    RETURN_TYPES = ("IMAGE", "IMAGE_LIST")
+    RETURN_NAMES = ("images", "image_list")
     FUNCTION = "combine"
     CATEGORY = "Comfyui_MiniCPM-V-2_6-int4"
     DESCRIPTION = """
 Creates an image batch from multiple images.  
 You can set how many inputs the node has,  
-with the **inputcount** and clicking update.
+with the **inputcount** and clicking update.  
+With **output** set to list, only **image_list**  
+is produced: it passes the images to the VQA node  
+at their own sizes without building a batch,  
+and **images** is empty.
 """
 
-    def combine(self, inputcount, **kwargs):
-        from nodes import ImageBatch
-
-        image_batch_node = ImageBatch()
-        image = kwargs["image_1"]
-        for c in range(1, inputcount):
-            new_image = kwargs[f"image_{c + 1}"]
-            (image,) = image_batch_node.batch(image, new_image)
-        return (image,)
\ No newline at end of file
+    def combine(self, inputcount, output="batch", **kwargs):
+        images = [kwargs[f"image_{c + 1}"] for c in range(inputcount)]
+        if output == "list":
+            return (None, images)
+        return (combine_images(images), images)
@@ -0,0 +1,225 @@
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+
+class TensorImage(Image.Image):
+    """A PIL stand-in that wraps a CHW float tensor in [0, 1] without copying it.
+
+    `model.chat` only accepts `PIL.Image` instances in the message content, so
+    ComfyUI tensors are wrapped in this class and the model's image processor
+    is taught (see `install_tensor_preprocess`) to slice and normalize them
+    directly in torch. `to_pil()` gives a real image for the PIL fallback.
+    """
+
+    def __init__(self, tensor, host_tensor=None):
+        super().__init__()
+        self.tensor = tensor
+        # the CPU original of a `tensor_gpu` image, so hashing never copies it back
+        self.host_tensor = tensor if host_tensor is None else host_tensor
+        self._size = (tensor.shape[2], tensor.shape[1])
+        if isinstance(getattr(Image.Image, "mode", None), property):
+            self._mode = "RGB"
+        else:
+            self.mode = "RGB"
+
+    def __deepcopy__(self, memo):
+        # `model.chat` deep copies the messages, the wrapped tensor is read only
+        return self
+
+    def copy(self):
+        return self
+
+    def convert(self, mode=None, *args, **kwargs):
+        if mode in (None, "RGB"):
+            return self
+        return self.to_pil().convert(mode, *args, **kwargs)
+
+    def tobytes(self, *args, **kwargs):
+        return self.host_tensor.detach().cpu().contiguous().numpy().tobytes()
+
+    def to_pil(self):
+        return to_pil_images(self.tensor[None])[0]
+
+
+def tensor_images(images, device=None):
+    """Wrap a ComfyUI IMAGE batch (BHWC float) as `TensorImage`s, one per image."""
+    host_images = images = images.permute([0, 3, 1, 2])
+    if device is not None:
+        images = images.to(device, non_blocking=True)
+    return [TensorImage(image, host) for image, host in zip(images, host_images)]
+
+
+def to_pil_images(images):
+    """Convert a BCHW float batch to PIL with one vectorized quantization."""
+    images = images.mul(255).round_().clamp_(0, 255).to(torch.uint8)
+    images = images.permute([0, 2, 3, 1]).cpu().numpy()
+    return [Image.fromarray(image, "RGB") for image in images]
+
+
+def supports_tensor_images(model):
+    # only MiniCPM-V 2.6 goes through a separate image processor we can hook into
+    return hasattr(model, "processor")
+
+
+def _resize(images, size):
+    width, height = size
+    if images.shape[-2:] == (height, width):
+        return images
+    images = F.interpolate(
+        images, size=(height, width), mode="bicubic", antialias=True, align_corners=False
+    )
+    return images.clamp_(0, 1)
+
+
+def _slice_images(image_processor, images, max_slice_nums):
+    """Torch port of `MiniCPMVImageProcessor.get_sliced_images` for a same-size batch.
+
+    Returns, per image, the source image followed by its grid patches.
+    """
+    if not image_processor.slice_mode:
+        return [[image] for image in images]
+    scale_resolution = image_processor.scale_resolution
+    patch_size = image_processor.patch_size
+    original_size = (images.shape[3], images.shape[2])
+
+    best_grid = image_processor.get_sliced_grid(original_size, max_slice_nums)
+    if best_grid is None:
+        best_size = image_processor.find_best_resize(
+            original_size, scale_resolution, patch_size, allow_upscale=True
+        )
+        return [[image] for image in _resize(images, best_size)]
+
+    best_resize = image_processor.find_best_resize(
+        original_size, scale_resolution, patch_size
+    )
+    sources = _resize(images, best_resize)
+    refine_size = image_processor.get_refine_size(
+        original_size, best_grid, scale_resolution, patch_size, allow_upscale=True
+    )
+    refined = _resize(images, refine_size)
+    grid_x = refine_size[0] // best_grid[0]
+    grid_y = refine_size[1] // best_grid[1]
+    slices = []
+    for source, refine in zip(sources, refined):
+        patches = [
+            refine[:, i : i + grid_y, j : j + grid_x]
+            for i in range(0, refine_size[1], grid_y)
+            for j in range(0, refine_size[0], grid_x)
+        ]
+        slices.append([source] + patches)
+    return slices
+
+
+def _reshape_by_patch(image, patch_size):
+    patches = F.unfold(image, (patch_size, patch_size), stride=(patch_size, patch_size))
+    patches = patches.reshape(image.size(0), patch_size, patch_size, -1)
+    return patches.permute(0, 1, 3, 2).reshape(image.size(0), patch_size, -1)
+
+
+def preprocess_tensor_images(image_processor, images, max_slice_nums=None):
+    """Equivalent of `MiniCPMVImageProcessor.preprocess` for `TensorImage` lists."""
+    max_slice_nums = (
+        image_processor.max_slice_nums if max_slice_nums is None else int(max_slice_nums)
+    )
+    patch_size = image_processor.patch_size
+    pixel_values_list, image_sizes_list, tgt_sizes_list = [], [], []
+    for _images in images:
+        if not _images:
+            pixel_values_list.append([])
+            image_sizes_list.append([])
+            tgt_sizes_list.append([])
+            continue
+
+        # images of the same size share one batched resize
+        sliced = [None] * len(_images)
+        groups = {}
+        for i, image in enumerate(_images):
+            key = (tuple(image.tensor.shape), image.tensor.device, image.tensor.dtype)
+            groups.setdefault(key, []).append(i)
+        for indices in groups.values():
+            batch = torch.stack([_images[i].tensor for i in indices]).float()
+            for i, slices in zip(indices, _slice_images(image_processor, batch, max_slice_nums)):
+                sliced[i] = slices
+
+        pixel_values, tgt_sizes = [], []
+        for slices in sliced:
+            for slice_image in slices:
+                mean = slice_image.new_tensor(image_processor.mean).view(-1, 1, 1)
+                std = slice_image.new_tensor(image_processor.std).view(-1, 1, 1)
+                slice_image = (slice_image - mean) / std
+                pixel_values.append(_reshape_by_patch(slice_image, patch_size))
+                tgt_sizes.append(
+                    (slice_image.shape[1] // patch_size, slice_image.shape[2] // patch_size)
+                )
+        pixel_values_list.append(pixel_values)
+        image_sizes_list.append([image.size for image in _images])
+        tgt_sizes_list.append(torch.tensor(tgt_sizes, dtype=torch.int32))
+
+    from transformers import BatchFeature
+
+    return BatchFeature(
+        data={
+            "pixel_values": pixel_values_list,
+            "image_sizes": image_sizes_list,
+            "tgt_sizes": tgt_sizes_list,
+        }
+    )
+
+
+def ensure_processor(model, model_checkpoint):
+    """Load the processor `model.chat` would otherwise load lazily on first use."""
+    if model.processor is None:
+        from transformers import AutoProcessor
+
+        model.processor = AutoProcessor.from_pretrained(
+            model_checkpoint, trust_remote_code=True
+        )
+    return model.processor
+
+
+def install_tensor_preprocess(model, model_checkpoint):
+    """Route `TensorImage` inputs of `model.chat` through the torch preprocessing."""
+    image_processor = ensure_processor(model, model_checkpoint).image_processor
+    if "preprocess" in image_processor.__dict__:
+        return
+    preprocess = image_processor.preprocess
+
+    def tensor_aware_preprocess(images, do_pad=True, max_slice_nums=None, return_tensors=None, **kwargs):
+        if isinstance(images, Image.Image):
+            images_list = [[images]]
+        elif images and isinstance(images[0], Image.Image):
+            images_list = [images]
+        else:
+            images_list = images
+        flat = [image for _images in images_list for image in (_images or [])]
+        if flat and all(isinstance(image, TensorImage) for image in flat):
+            return preprocess_tensor_images(image_processor, images_list, max_slice_nums)
+
+        # mixed or plain PIL input: use the original processor
+        images_list = [
+            [image.to_pil() if isinstance(image, TensorImage) else image for image in _images or []]
+            for _images in images_list
+        ]
+        return preprocess(
+            images_list,
+            do_pad=do_pad,
+            max_slice_nums=max_slice_nums,
+            return_tensors=return_tensors,
+            **kwargs,
+        )
+
+    image_processor.preprocess = tensor_aware_preprocess
+
+
+def model_images(model, model_checkpoint, images, mode="tensor"):
+    """Turn a ComfyUI IMAGE batch into the image list `model.chat` expects.
+
+    `mode` is "tensor" (slice and normalize in torch on the CPU), "tensor_gpu"
+    (same, on the model's device) or "pil" (the model's own PIL processor,
+    always used for models without a separate image processor).
+    """
+    if mode != "pil" and supports_tensor_images(model):
+        install_tensor_preprocess(model, model_checkpoint)
+        return tensor_images(images, model.device if mode == "tensor_gpu" else None)
+    return to_pil_images(images.permute([0, 3, 1, 2]))
@@ -0,0 +1,130 @@
+import torch
+from PIL import Image
+from .image_preprocess import ensure_processor
+from .generation_utils import patched_generate
+from .profiling import stage, record, increment
+
+
+def supports_kv_reuse(model):
+    # the prompt is built with MiniCPM-V 2.6's processor, 2.5 has none
+    return hasattr(model, "processor")
+
+
+def build_inputs(model, model_checkpoint, msgs, max_slice_nums, system_prompt=""):
+    """Tokenize `msgs` exactly like `model.chat` does, for a batch of one."""
+    processor = ensure_processor(model, model_checkpoint)
+    images = []
+    prompt_msgs = []
+    if system_prompt:
+        prompt_msgs.append({"role": "system", "content": system_prompt})
+    for msg in msgs:
+        content = []
+        for c in msg["content"]:
+            if isinstance(c, Image.Image):
+                images.append(c)
+                content.append("(<image>./</image>)")
+            elif isinstance(c, str):
+                content.append(c)
+        prompt_msgs.append({"role": msg["role"], "content": "\n".join(content)})
+    prompt = processor.tokenizer.apply_chat_template(
+        prompt_msgs, tokenize=False, add_generation_prompt=True
+    )
+    inputs = processor(
+        [prompt],
+        [images],
+        max_slice_nums=max_slice_nums,
+        use_image_id=False,
+        return_tensors="pt",
+        max_length=8192,
+    ).to(model.device)
+    inputs.pop("image_sizes")
+    return inputs
+
+
+def common_prefix_length(a, b):
+    length = min(len(a), len(b))
+    mismatch = (a[:length] != b[:length]).nonzero()
+    return int(mismatch[0]) if len(mismatch) else length
+
+
+def crop_cache(cache, length):
+    if hasattr(cache, "crop"):
+        cache.crop(length)
+        return
+    for i in range(len(cache.key_cache)):
+        cache.key_cache[i] = cache.key_cache[i][..., :length, :]
+        cache.value_cache[i] = cache.value_cache[i][..., :length, :]
+    if hasattr(cache, "_seen_tokens"):
+        cache._seen_tokens = length
+    elif hasattr(cache, "seen_tokens"):
+        cache.seen_tokens = length
+
+
+def cache_nbytes(cache):
+    return sum(
+        t.numel() * t.element_size() for t in [*cache.key_cache, *cache.value_cache]
+    )
+
+
+def generate_with_cache(
+    model,
+    tokenizer,
+    inputs,
+    cache=None,
+    cached_length=0,
+    vision_hidden_states=None,
+    **generation_kwargs,
+):
+    """Generate an answer, prefilling only the tokens not covered by `cache`.
+
+    `cache` must hold the key/values of the first `cached_length` tokens of
+    `inputs["input_ids"]`. Vision embeddings are only computed when an image
+    lies in the uncached part of the prompt, and reused from
+    `vision_hidden_states` when given. Returns the answer, the extended cache
+    and the token ids it now covers.
+    """
+    input_ids = inputs["input_ids"]
+    length = input_ids.shape[1]
+    # the last prompt token is always fed through `generate`
+    cached_length = min(cached_length, length - 1)
+    if cache is None or cached_length <= 0:
+        from transformers import DynamicCache
+
+        cache, cached_length = DynamicCache(), 0
+    else:
+        crop_cache(cache, cached_length)
+
+    image_bound = inputs["image_bound"][0]
+    if len(image_bound) and int(image_bound[:, 1].max()) > cached_length:
+        data = {
+            "input_ids": input_ids,
+            "image_bound": inputs["image_bound"],
+            "pixel_values": inputs["pixel_values"],
+            "tgt_sizes": inputs["tgt_sizes"],
+        }
+        if vision_hidden_states is not None:
+            data["vision_hidden_states"] = vision_hidden_states
+        inputs_embeds, _ = model.get_vllm_embedding(data)
+        inputs_embeds = inputs_embeds[:, cached_length:-1]
+    else:
+        inputs_embeds = model.llm.get_input_embeddings()(input_ids[:, cached_length:-1])
+    if inputs_embeds.shape[1]:
+        # prefill without the lm head, only the cache is needed
+        with stage("prefill"):
+            model.llm.model(inputs_embeds=inputs_embeds, past_key_values=cache, use_cache=True)
+    record("prompt_tokens_cached", cached_length)
+
+    terminators = [tokenizer.convert_tokens_to_ids(t) for t in model.terminators]
+    with stage("generate"), patched_generate(model):
+        output = model.llm.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=cache,
+            pad_token_id=0,
+            eos_token_id=terminators,
+            **generation_kwargs,
+        )
+    new_tokens = [t for t in output[0, length:].tolist() if t not in terminators and t != 0]
+    increment("generated_tokens", len(new_tokens))
+    answer = tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+    return answer, cache, output[0, : cache.get_seq_length()].cpu()
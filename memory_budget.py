@@ -0,0 +1,190 @@
+import gc
+import os
+
+import torch
+from .video_utils import uniform_sample
+from .profiling import record
+
+BUDGET_MODES = ["fixed", "auto"]
+
+# transient activations of one 448x448 slice in the SigLIP vision tower
+VISION_BYTES_PER_SLICE = 64 * 1024**2
+
+
+def free_memory(device):
+    """Bytes a request can still allocate on `device`."""
+    if device.type == "cuda":
+        free, _ = torch.cuda.mem_get_info(device)
+        # memory cached by torch but not in use is free for us too
+        return free + torch.cuda.memory_reserved(device) - torch.cuda.memory_allocated(device)
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def model_max_slice_nums(model, max_slice_nums):
+    """Most slices per image the model was trained with, at least `max_slice_nums`."""
+    image_processor = getattr(getattr(model, "processor", None), "image_processor", None)
+    limit = getattr(image_processor, "max_slice_nums", None)
+    if limit is None:
+        limit = getattr(model.config, "max_slice_nums", max_slice_nums)
+    return max(limit, max_slice_nums, 1)
+
+
+def count_slices(model, sizes, max_slice_nums):
+    """Number of slices (thumbnail included) the images of `sizes` are cut into."""
+    image_processor = getattr(getattr(model, "processor", None), "image_processor", None)
+    if image_processor is None or not getattr(image_processor, "slice_mode", True):
+        # MiniCPM-V 2.5 slices inside the model: assume the most slices
+        return len(sizes) * (max_slice_nums + 1)
+    slices = 0
+    for size in sizes:
+        # the same grid the processor picks, small images are not sliced at all
+        grid = image_processor.get_sliced_grid(size, max_slice_nums)
+        slices += 1 if grid is None else 1 + grid[0] * grid[1]
+    return slices
+
+
+def request_bytes(model, slices, text_tokens, max_new_tokens):
+    """Rough upper bound of the memory one `model.chat` call allocates on top of the weights."""
+    config = model.llm.config
+    element_size = torch.finfo(model.dtype).bits // 8
+    head_dim = config.hidden_size // config.num_attention_heads
+    kv_heads = getattr(config, "num_key_value_heads", config.num_attention_heads)
+    query_num = getattr(model.config, "query_num", 64)
+
+    prompt = slices * (query_num + 2) + text_tokens
+    kv_cache = (
+        (prompt + max_new_tokens)
+        * 2
+        * config.num_hidden_layers
+        * kv_heads
+        * head_dim
+        * element_size
+    )
+    # hidden states and MLP activations of one layer, and float32 logits
+    prefill = prompt * (
+        (4 * config.hidden_size + 3 * config.intermediate_size) * element_size
+        + config.vocab_size * 4
+    )
+    vision_batch = min(slices, getattr(model.config, "vision_batch_size", 16))
+    return kv_cache + prefill + vision_batch * VISION_BYTES_PER_SLICE
+
+
+class Budget:
+    """Number of images and slices per image a request is run with."""
+
+    def __init__(self, num_images, max_slice_nums, droppable):
+        self.num_images = num_images
+        self.max_slice_nums = max_slice_nums
+        # only video frames can be dropped, every input image is needed
+        self.droppable = droppable
+
+    def shrink(self):
+        """A smaller budget, or None if this is already the smallest one."""
+        if self.max_slice_nums > 1:
+            return Budget(self.num_images, self.max_slice_nums - 1, self.droppable)
+        if self.droppable and self.num_images > 1:
+            return Budget(self.num_images // 2, 1, self.droppable)
+        return None
+
+    def apply(self, msgs):
+        content = msgs[-1]["content"]
+        images = [c for c in content if not isinstance(c, str)]
+        if len(images) > self.num_images:
+            images = uniform_sample(images, self.num_images)
+        text = [c for c in content if isinstance(c, str)]
+        return msgs[:-1] + [{"role": msgs[-1]["role"], "content": images + text}]
+
+
+def fit_budget(model, tokenizer, msgs, max_slice_nums, max_new_tokens, droppable):
+    """Budget with the most image tokens whose estimate fits in free memory.
+
+    Slices per image may go above `max_slice_nums`, up to the model's limit,
+    when every image still fits; images (video frames) are only ever dropped,
+    since they are decoded before the budget is known.
+    """
+    content = msgs[-1]["content"]
+    sizes = [c.size for c in content if not isinstance(c, str)]
+    num_images = len(sizes)
+    budget = Budget(num_images, max_slice_nums, droppable)
+    free = free_memory(model.device)
+    if not num_images or free is None:
+        return budget
+
+    margin = float(os.environ.get("MINICPM_AUTO_BUDGET_MARGIN", 0.85))
+    text_tokens = sum(len(tokenizer.encode(c)) for c in content if isinstance(c, str))
+
+    def slices_of(n, slices):
+        kept = sizes if n == num_images else uniform_sample(sizes, n)
+        return count_slices(model, kept, slices)
+
+    def fits(n, slices):
+        return request_bytes(model, slices_of(n, slices), text_tokens, max_new_tokens) <= free * margin
+
+    best = None
+    for slices in range(model_max_slice_nums(model, max_slice_nums), 0, -1):
+        n = num_images
+        # more slices than requested only if no frame has to go for them
+        while droppable and slices <= max_slice_nums and n > 1 and not fits(n, slices):
+            n -= 1
+        if not fits(n, slices):
+            continue
+        # the most image tokens wins, then the most frames; on a tie the fewer
+        # slices, e.g. for images too small to be sliced anyway
+        if best is None or (slices_of(n, slices), n) >= (
+            slices_of(best.num_images, best.max_slice_nums),
+            best.num_images,
+        ):
+            best = Budget(n, slices, droppable)
+    best = best or Budget(1 if droppable else num_images, 1, droppable)
+    print(
+        f"Auto budget: {best.num_images} of {num_images} images, "
+        f"max_slice_nums {best.max_slice_nums} ({free / 1024**3:.1f} GiB free)"
+    )
+    return best
+
+
+def run_with_budget(
+    model,
+    tokenizer,
+    msgs,
+    max_slice_nums,
+    max_new_tokens,
+    generate,
+    auto=False,
+    droppable=False,
+):
+    """Call `generate(msgs, max_slice_nums)`, fitting the request to free memory if `auto`.
+
+    In auto mode the number of images is an upper bound and `max_slice_nums`
+    a starting point (see `fit_budget`); a CUDA out of memory error frees the
+    cached memory and retries with a smaller budget until the smallest one
+    fails too.
+    """
+    if not auto:
+        return generate(msgs, max_slice_nums)
+
+    budget = fit_budget(model, tokenizer, msgs, max_slice_nums, max_new_tokens, droppable)
+    retries = 0
+    while True:
+        record("budget_images", budget.num_images)
+        record("budget_max_slice_nums", budget.max_slice_nums)
+        try:
+            return generate(budget.apply(msgs), budget.max_slice_nums)
+        except torch.cuda.OutOfMemoryError:
+            smaller = budget.shrink()
+            if smaller is None:
+                raise
+        # outside of the except block, so the traceback no longer holds the activations
+        gc.collect()
+        torch.cuda.empty_cache()
+        retries += 1
+        record("oom_retries", retries)
+        print(
+            f"CUDA out of memory with {budget.num_images} images and max_slice_nums "
+            f"{budget.max_slice_nums}, retrying with {smaller.num_images} and "
+            f"{smaller.max_slice_nums}"
+        )
+        budget = smaller
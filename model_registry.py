@@ -0,0 +1,299 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+import folder_paths
+from .profiling import stage, record
+from .provisioning import is_complete, provision
+
+DEVICE_MODES = ["auto", "gpu", "sequential_offload", "cpu"]
+
+
+def get_model_checkpoint(model, repo_id=None):
+    """Return the local checkpoint directory for `model`, downloading it if incomplete.
+
+    `repo_id` defaults to the openbmb repository of `model`.
+    """
+    model_id = repo_id or f"openbmb/{model}"
+    model_checkpoint = os.path.join(
+        folder_paths.models_dir, "prompt_generator", os.path.basename(model_id)
+    )
+
+    # a directory left by an interrupted download is resumed, not loaded
+    if not is_complete(model_checkpoint):
+        provision(model_id, model_checkpoint)
+    return model_checkpoint
+
+
+def load_settings(model, device_mode="auto"):
+    """Resolve the checkpoint, dtype and device mode used to serve `model`.
+
+    The int4 checkpoints are bitsandbytes-quantized and only run on CUDA, so
+    the CPU and sequential offload modes use the full precision checkpoint of
+    the same model instead.
+    """
+    if device_mode == "auto":
+        device_mode = "gpu" if torch.cuda.is_available() else "cpu"
+    if device_mode != "cpu" and not torch.cuda.is_available():
+        raise ValueError(f"device_mode '{device_mode}' needs a CUDA device")
+
+    if device_mode == "cpu":
+        torch_dtype = getattr(torch, os.environ.get("MINICPM_CPU_DTYPE", "bfloat16"))
+    elif torch.cuda.get_device_capability(torch.device("cuda"))[0] >= 8:
+        torch_dtype = torch.bfloat16
+    else:
+        torch_dtype = torch.float16
+    if device_mode != "gpu" and model.endswith("-int4"):
+        model = model[: -len("-int4")]
+    with stage("download_check"):
+        model_checkpoint = get_model_checkpoint(model)
+    return model_checkpoint, torch_dtype, device_mode
+
+
+def _checkpoint_size(model_checkpoint):
+    # rough estimate of the resident size of a checkpoint before it is loaded
+    total = 0
+    for name in os.listdir(model_checkpoint):
+        if name.endswith((".safetensors", ".bin")):
+            total += os.path.getsize(os.path.join(model_checkpoint, name))
+    return total
+
+
+def _release_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()  # release GPU memory
+        torch.cuda.ipc_collect()
+
+
+def _offload_max_memory():
+    gpu_budget = os.environ.get("MINICPM_OFFLOAD_GPU_GB")
+    if gpu_budget is None:
+        free, _ = torch.cuda.mem_get_info()
+        gpu_budget = free * 0.8 / 1024**3
+    return {0: f"{float(gpu_budget):.2f}GiB", "cpu": "1024GiB"}
+
+
+class ModelEntry:
+    def __init__(self, key, model, tokenizer, size):
+        self.key = key
+        self.model = model
+        self.tokenizer = tokenizer
+        self.size = size
+        self.refcount = 0
+        self.keep_loaded = False
+        self.parked = False
+        self.last_used = time.monotonic()
+        # cleared while the loading caller warms the model up
+        self.ready = threading.Event()
+        self.ready.set()
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded models shared by every VQA node.
+
+    Entries are keyed by (checkpoint, dtype, attention implementation, device
+    mode) and reference counted while a node is using them. Idle entries are
+    evicted least-recently-used first when `memory_budget` (bytes of device
+    memory, 0 = unlimited) would be exceeded, and entries released with
+    `keep_loaded=False` are unloaded once they have been idle for
+    `idle_timeout` seconds, or parked in CPU memory when released with
+    `park=True` (at most `max_parked` of them).
+    """
+
+    def __init__(self, memory_budget=0, idle_timeout=0, max_parked=1):
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self.max_parked = max_parked
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._timer = None
+        self._unload_listeners = []
+
+    @classmethod
+    def from_env(cls):
+        budget_gb = float(os.environ.get("MINICPM_MODEL_MEMORY_BUDGET_GB", 0))
+        idle_timeout = float(os.environ.get("MINICPM_MODEL_IDLE_TIMEOUT", 0))
+        max_parked = int(os.environ.get("MINICPM_MAX_PARKED_MODELS", 1))
+        return cls(int(budget_gb * 1024**3), idle_timeout, max_parked)
+
+    def acquire(
+        self,
+        model_checkpoint,
+        torch_dtype,
+        attn_implementation="sdpa",
+        device_mode="gpu",
+        warm_up=None,
+    ):
+        """Return the entry of the model, loading it if needed.
+
+        `warm_up(entry)` runs once after a fresh load; other callers acquiring
+        the entry meanwhile wait until it has finished, so they never share
+        the model with it.
+        """
+        key = (model_checkpoint, str(torch_dtype), attn_implementation, device_mode)
+        loaded = False
+        with self._lock:
+            entry = self._entries.get(key)
+            record("model_cache", "miss" if entry is None or entry.parked else "hit")
+            if entry is None:
+                self._make_room(_checkpoint_size(model_checkpoint))
+                entry = self._load(
+                    key, model_checkpoint, torch_dtype, attn_implementation, device_mode
+                )
+                self._entries[key] = entry
+                if warm_up is not None:
+                    loaded = True
+                    entry.ready.clear()
+            elif entry.parked:
+                self._make_room(entry.size)
+                print("Moving parked model back to GPU:", model_checkpoint)
+                with stage("model_load"):
+                    entry.model.to(torch.device("cuda"))
+                entry.parked = False
+            self._entries.move_to_end(key)
+            entry.refcount += 1
+            entry.last_used = time.monotonic()
+        if loaded:
+            try:
+                warm_up(entry)
+            except Exception:
+                self.release(entry)
+                raise
+            finally:
+                entry.ready.set()
+        entry.ready.wait()
+        return entry
+
+    def release(self, entry, keep_loaded=False, park=False):
+        with self._lock:
+            entry.refcount -= 1
+            entry.last_used = time.monotonic()
+            entry.keep_loaded = keep_loaded
+            if entry.refcount > 0 or keep_loaded:
+                return
+            if park and self._park(entry):
+                return
+            if self.idle_timeout <= 0:
+                self._evict(entry.key)
+            else:
+                self._schedule_sweep()
+
+    def unload(self, model_checkpoint=None):
+        """Unload every idle entry, or only those of `model_checkpoint`."""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.refcount == 0 and model_checkpoint in (None, key[0]):
+                    self._evict(key)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def add_unload_listener(self, listener):
+        """Call `listener(entry)` whenever a model is unloaded or parked on the CPU."""
+        self._unload_listeners.append(listener)
+
+    def _notify_unload(self, entry):
+        for listener in self._unload_listeners:
+            listener(entry)
+
+    def _load(self, key, model_checkpoint, torch_dtype, attn_implementation, device_mode):
+        from transformers import AutoTokenizer, AutoModel
+
+        with stage("tokenizer_load"):
+            tokenizer = AutoTokenizer.from_pretrained(
+                model_checkpoint,
+                trust_remote_code=True,
+                low_cpu_mem_usage=True,
+            )
+        kwargs = {}
+        if device_mode == "sequential_offload":
+            # layers that do not fit the GPU budget stay on the CPU and are
+            # streamed to the GPU by accelerate for every forward pass
+            kwargs = {"device_map": "auto", "max_memory": _offload_max_memory()}
+        with stage("model_load"):
+            model = AutoModel.from_pretrained(
+                model_checkpoint,
+                trust_remote_code=True,
+                low_cpu_mem_usage=True,
+                attn_implementation=attn_implementation,
+                torch_dtype=torch_dtype,
+                **kwargs,
+            )
+            if device_mode == "gpu" and model.device.type != "cuda":
+                # only the bitsandbytes checkpoints are placed on the GPU while loading
+                model = model.to(torch.device("cuda"))
+            model.eval()
+        try:
+            size = model.get_memory_footprint()
+        except Exception:
+            size = _checkpoint_size(model_checkpoint)
+        return ModelEntry(key, model, tokenizer, size)
+
+    def _park(self, entry):
+        if entry.key[3] != "gpu":
+            return False
+        try:
+            entry.model.to(torch.device("cpu"))
+        except (ValueError, RuntimeError) as e:
+            # older bitsandbytes/transformers cannot move 4-bit weights
+            print("Cannot park model on CPU, unloading it instead:", e)
+            return False
+        print("Parked model on CPU:", entry.key[0])
+        entry.parked = True
+        self._notify_unload(entry)
+        _release_memory()
+        parked = [key for key, e in self._entries.items() if e.parked and e.refcount == 0]
+        for key in parked[: max(len(parked) - self.max_parked, 0)]:
+            self._evict(key)
+        return entry.key in self._entries
+
+    def _evict(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        print("Unloading model:", key[0])
+        self._notify_unload(entry)
+        del entry.model  # release model memory
+        del entry.tokenizer  # release tokenizer memory
+        _release_memory()
+
+    def _make_room(self, required):
+        if self.memory_budget <= 0:
+            return
+        used = sum(entry.size for entry in self._entries.values() if not entry.parked)
+        for key, entry in list(self._entries.items()):  # least recently used first
+            if used + required <= self.memory_budget:
+                break
+            if entry.refcount == 0 and not entry.parked:
+                used -= entry.size
+                self._evict(key)
+
+    def _sweep(self):
+        with self._lock:
+            self._timer = None
+            now = time.monotonic()
+            pending = False
+            for key, entry in list(self._entries.items()):
+                if entry.refcount > 0 or entry.keep_loaded or entry.parked:
+                    continue
+                if now - entry.last_used >= self.idle_timeout:
+                    self._evict(key)
+                else:
+                    pending = True
+            if pending:
+                self._schedule_sweep()
+
+    def _schedule_sweep(self):
+        if self._timer is not None:
+            return
+        self._timer = threading.Timer(self.idle_timeout, self._sweep)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+registry = ModelRegistry.from_env()
@@ -0,0 +1,95 @@
+import torch
+from .model_registry import DEVICE_MODES
+from .image_preprocess import model_images
+from .batch_engine import BatchEngine, VQARequest
+from .vqa_core import sampling_input_types, sampling_kwargs, acquired_model
+
+
+class MiniCPM_Batch_VQA:
+    def __init__(self):
+        self.model_checkpoint = None
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "images": ("IMAGE",),
+                "prompts": (
+                    "STRING",
+                    {"default": "Describe this image.", "multiline": True},
+                ),  # one prompt per line, a single line is used for every image
+                "model": (
+                    ["MiniCPM-V-2_6-int4", "MiniCPM-Llama3-V-2_5-int4"],
+                    {"default": "MiniCPM-V-2_6-int4"},
+                ),
+                "keep_model_loaded": ("BOOLEAN", {"default": False}),
+                **sampling_input_types(),
+                "max_slice_nums": (
+                    "INT",
+                    {
+                        "default": 2,
+                    },
+                ),
+                "batch_size": ("INT", {"default": 8, "min": 1, "max": 256}),
+                "seed": ("INT", {"default": -1}),
+            },
+            "optional": {
+                "image_preprocess": (["tensor", "tensor_gpu", "pil"], {"default": "tensor"}),
+                "device_mode": (DEVICE_MODES, {"default": "auto"}),
+                "park_on_cpu": ("BOOLEAN", {"default": False}),
+            },
+        }
+
+    RETURN_TYPES = ("STRING",)
+    OUTPUT_IS_LIST = (True,)
+    FUNCTION = "inference"
+    CATEGORY = "Comfyui_MiniCPM-V-2_6-int4"
+
+    def inference(
+        self,
+        images,
+        prompts,
+        model,
+        keep_model_loaded,
+        top_p,
+        top_k,
+        temperature,
+        repetition_penalty,
+        max_new_tokens,
+        max_slice_nums,
+        batch_size,
+        seed,
+        image_preprocess="tensor",
+        device_mode="auto",
+        park_on_cpu=False,
+    ):
+        if seed != -1:
+            torch.manual_seed(seed)
+        prompts = [line for line in prompts.splitlines() if line.strip()] or [""]
+        if len(prompts) == 1:
+            prompts = prompts * len(images)
+        elif len(prompts) != len(images):
+            raise ValueError(
+                f"Got {len(prompts)} prompts for {len(images)} images, "
+                "provide one prompt or one prompt per image"
+            )
+
+        sampling_params = sampling_kwargs(
+            top_p, top_k, temperature, repetition_penalty, max_new_tokens
+        )
+        with acquired_model(
+            self, model, device_mode, keep_model_loaded, park_on_cpu
+        ) as model_entry, torch.no_grad():
+            engine = BatchEngine(batch_size)
+            requests = []
+            images = model_images(
+                model_entry.model, self.model_checkpoint, images, image_preprocess
+            )
+            for image, prompt in zip(images, prompts):
+                msgs = [{"role": "user", "content": [image, prompt]}]
+                requests.append(
+                    engine.submit(VQARequest(msgs, sampling_params, max_slice_nums))
+                )
+            engine.flush(model_entry.model, model_entry.tokenizer)
+
+        return ([request.result for request in requests],)
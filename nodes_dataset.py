@@ -0,0 +1,333 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from PIL import Image, ImageOps
+from .model_registry import DEVICE_MODES
+from .batch_engine import BatchEngine, VQARequest
+from .video_utils import encode_video, format_timestamp
+from .profiling import bind
+from .vqa_core import sampling_input_types, sampling_kwargs, acquired_model
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".mov", ".avi", ".flv", ".wmv", ".webm", ".m4v")
+
+
+def list_dataset(directory, recursive=True, include_videos=True):
+    """Relative paths of the images (and videos) under `directory`, sorted."""
+    extensions = IMAGE_EXTENSIONS + (VIDEO_EXTENSIONS if include_videos else ())
+    files = []
+    for root, dirs, names in os.walk(directory):
+        if not recursive:
+            dirs.clear()
+        dirs.sort()
+        for name in names:
+            if name.lower().endswith(extensions):
+                files.append(os.path.relpath(os.path.join(root, name), directory))
+    return sorted(files)
+
+
+def caption_paths(files):
+    """Relative `.txt` caption path of each of `files`.
+
+    Captions go next to the file with its extension replaced (`img.txt`), as
+    training tools expect; files sharing a stem (`img.png` and `img.jpg`)
+    keep their extension instead (`img.png.txt`) so their captions don't
+    overwrite each other.
+    """
+    stems = {}
+    for file in files:
+        stem = os.path.splitext(file)[0]
+        # lower case, case-insensitive file systems collide on IMG/img too
+        stems.setdefault(stem.lower(), []).append((file, stem))
+    paths = {}
+    for group in stems.values():
+        for file, stem in group:
+            paths[file] = (stem if len(group) == 1 else file) + ".txt"
+    return paths
+
+
+def read_jsonl_files(jsonl_path):
+    """Files already captioned in `jsonl_path`, ignoring a line cut short by a crash."""
+    done = set()
+    if not os.path.exists(jsonl_path):
+        return done
+    with open(jsonl_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["file"])
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+def load_item(path, video_max_num_frames, max_slice_nums):
+    if path.lower().endswith(VIDEO_EXTENSIONS):
+        return encode_video(path, video_max_num_frames, "uniform", max_slice_nums)
+    with Image.open(path) as image:
+        return [ImageOps.exif_transpose(image).convert("RGB")]
+
+
+class CaptionWriter:
+    """Writes captions on a background thread so disk I/O overlaps generation.
+
+    `.txt` files are replaced atomically and every JSONL line is flushed, so a
+    crash never leaves a half written caption behind. Files whose captions
+    could not be written are collected in `failed`.
+    """
+
+    def __init__(self, directory, txt_paths=None, jsonl_path=None):
+        self.directory = directory
+        # file -> caption path (see `caption_paths`), None for JSONL only
+        self.txt_paths = txt_paths
+        self._jsonl = None
+        if jsonl_path:
+            cut_short = False
+            if os.path.exists(jsonl_path) and os.path.getsize(jsonl_path):
+                with open(jsonl_path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    cut_short = f.read(1) != b"\n"
+            self._jsonl = open(jsonl_path, "a", encoding="utf-8")
+            if cut_short:
+                # terminate the line a crash left unfinished before appending
+                self._jsonl.write("\n")
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="minicpm-captions")
+        self._futures = []
+        self.failed = []
+
+    def write(self, file, caption):
+        self._futures.append((file, self._executor.submit(self._write, file, caption)))
+
+    def check(self):
+        """Collect the writes finished so far, report and return the failed ones."""
+        pending = []
+        for file, future in self._futures:
+            if not future.done():
+                pending.append((file, future))
+            elif future.exception() is not None:
+                print(f"Writing the caption of {file} failed: {future.exception()}")
+                self.failed.append(file)
+        self._futures = pending
+        return self.failed
+
+    def _write(self, file, caption):
+        if self.txt_paths is not None:
+            path = os.path.join(self.directory, self.txt_paths[file])
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(caption)
+            os.replace(path + ".tmp", path)
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps({"file": file, "caption": caption}, ensure_ascii=False) + "\n")
+            self._jsonl.flush()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._jsonl is not None:
+            self._jsonl.close()
+        return self.check()
+
+
+class MiniCPM_Dataset_Caption:
+    def __init__(self):
+        self.model_checkpoint = None
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "directory": ("STRING", {"default": ""}),
+                "prompt": (
+                    "STRING",
+                    {"default": "Describe this image in detail.", "multiline": True},
+                ),
+                "model": (
+                    ["MiniCPM-V-2_6-int4", "MiniCPM-Llama3-V-2_5-int4"],
+                    {"default": "MiniCPM-V-2_6-int4"},
+                ),
+                "keep_model_loaded": ("BOOLEAN", {"default": False}),
+                "output_format": (["txt", "jsonl", "txt_and_jsonl"], {"default": "txt"}),
+                "skip_existing": ("BOOLEAN", {"default": True}),
+                **sampling_input_types(512),
+                "max_slice_nums": (
+                    "INT",
+                    {
+                        "default": 2,
+                    },
+                ),
+                "batch_size": ("INT", {"default": 8, "min": 1, "max": 64}),
+                "seed": ("INT", {"default": -1}),
+            },
+            "optional": {
+                "recursive": ("BOOLEAN", {"default": True}),
+                "include_videos": ("BOOLEAN", {"default": True}),
+                "video_max_num_frames": ("INT", {"default": 16}),
+                "jsonl_path": ("STRING", {"default": ""}),  # default: <directory>/captions.jsonl
+                "prefetch": ("INT", {"default": 16, "min": 1, "max": 256}),
+                "device_mode": (DEVICE_MODES, {"default": "auto"}),
+                "park_on_cpu": ("BOOLEAN", {"default": False}),
+            },
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("summary",)
+    FUNCTION = "caption"
+    OUTPUT_NODE = True
+    CATEGORY = "Comfyui_MiniCPM-V-2_6-int4"
+
+    def caption(
+        self,
+        directory,
+        prompt,
+        model,
+        keep_model_loaded,
+        output_format,
+        skip_existing,
+        top_p,
+        top_k,
+        temperature,
+        repetition_penalty,
+        max_new_tokens,
+        max_slice_nums,
+        batch_size,
+        seed,
+        recursive=True,
+        include_videos=True,
+        video_max_num_frames=16,
+        jsonl_path="",
+        prefetch=16,
+        device_mode="auto",
+        park_on_cpu=False,
+    ):
+        if not os.path.isdir(directory):
+            raise ValueError(f"Dataset directory not found: {directory}")
+        if seed != -1:
+            torch.manual_seed(seed)
+        write_txt = output_format in ("txt", "txt_and_jsonl")
+        if output_format in ("jsonl", "txt_and_jsonl"):
+            jsonl_path = jsonl_path or os.path.join(directory, "captions.jsonl")
+        else:
+            jsonl_path = None
+
+        files = list_dataset(directory, recursive, include_videos)
+        # from the whole listing, so the paths don't change when a run resumes
+        txt_paths = caption_paths(files) if write_txt else None
+        if skip_existing:
+            # a file is done once every requested output exists, so a crashed run resumes
+            in_jsonl = read_jsonl_files(jsonl_path) if jsonl_path else set()
+
+            def has_captions(file):
+                return (
+                    not write_txt or os.path.exists(os.path.join(directory, txt_paths[file]))
+                ) and (
+                    not jsonl_path or file in in_jsonl
+                )
+
+            files = [f for f in files if not has_captions(f)]
+        print(f"Dataset captioning: {len(files)} files to caption in {directory}")
+        if not files:
+            return {"ui": {"text": ["Nothing to caption"]}, "result": ("Nothing to caption",)}
+
+        sampling_params = sampling_kwargs(
+            top_p, top_k, temperature, repetition_penalty, max_new_tokens
+        )
+        with acquired_model(self, model, device_mode, keep_model_loaded, park_on_cpu) as model_entry:
+            loader = ThreadPoolExecutor(
+                max_workers=min(prefetch, os.cpu_count() or 4),
+                thread_name_prefix="minicpm-dataset",
+            )
+            writer = CaptionWriter(directory, txt_paths, jsonl_path)
+            write_failed = []
+            try:
+                with torch.no_grad():
+                    captioned, failed = self.run(
+                        model_entry,
+                        directory,
+                        files,
+                        prompt,
+                        loader,
+                        writer,
+                        prefetch,
+                        batch_size,
+                        sampling_params,
+                        max_slice_nums,
+                        video_max_num_frames,
+                    )
+            finally:
+                loader.shutdown(wait=False, cancel_futures=True)
+                write_failed = writer.close()
+
+        captioned -= len(write_failed)
+        summary = f"Captioned {captioned} of {len(files)} files"
+        if failed:
+            summary += f", {failed} failed to load"
+        if write_failed:
+            summary += f", {len(write_failed)} failed to write"
+        return {"ui": {"text": [summary]}, "result": (summary,)}
+
+    def run(
+        self,
+        model_entry,
+        directory,
+        files,
+        prompt,
+        loader,
+        writer,
+        prefetch,
+        batch_size,
+        sampling_params,
+        max_slice_nums,
+        video_max_num_frames,
+    ):
+        import comfy.model_management
+        import comfy.utils
+
+        progress = comfy.utils.ProgressBar(len(files))
+        queue = deque()
+        remaining = iter(files)
+
+        def fill():
+            # keep `prefetch` files decoding while the model is busy
+            for file in remaining:
+                path = os.path.join(directory, file)
+                queue.append(
+                    (file, loader.submit(bind(load_item), path, video_max_num_frames, max_slice_nums))
+                )
+                if len(queue) >= prefetch:
+                    break
+
+        captioned = failed = 0
+        start = time.perf_counter()
+        fill()
+        while queue:
+            comfy.model_management.throw_exception_if_processing_interrupted()
+            engine = BatchEngine(batch_size)
+            batch = []
+            while queue and len(batch) < batch_size:
+                file, future = queue.popleft()
+                try:
+                    content = future.result()
+                except Exception as e:
+                    print(f"Skipping {file}: {e}")
+                    failed += 1
+                    continue
+                msgs = [{"role": "user", "content": content + [prompt]}]
+                batch.append((file, engine.submit(VQARequest(msgs, sampling_params, max_slice_nums))))
+            fill()
+            engine.flush(model_entry.model, model_entry.tokenizer)
+            for file, request in batch:
+                writer.write(file, request.result)
+            captioned += len(batch)
+            writer.check()  # report write errors as they happen
+
+            done = captioned + failed
+            progress.update_absolute(done, len(files))
+            rate = captioned / (time.perf_counter() - start)
+            eta = (len(files) - done) / rate if rate else 0
+            print(
+                f"Dataset captioning: {done}/{len(files)} files, "
+                f"{rate:.2f} files/s, ETA {format_timestamp(eta)}"
+            )
+        return captioned, failed
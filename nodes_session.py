@@ -0,0 +1,132 @@
+import torch
+from .model_registry import DEVICE_MODES
+from .image_preprocess import model_images
+from .generation_utils import run_chat
+from .profiling import stage
+from .chat_session import ChatSession, SessionState, session_store
+from .vqa_core import sampling_input_types, sampling_kwargs, acquired_model
+from .kv_generation import (
+    supports_kv_reuse,
+    build_inputs,
+    common_prefix_length,
+    generate_with_cache,
+)
+
+
+class MiniCPM_Chat_Session:
+    def __init__(self):
+        self.model_checkpoint = None
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "text": ("STRING", {"default": "", "multiline": True}),
+                "model": (
+                    ["MiniCPM-V-2_6-int4", "MiniCPM-Llama3-V-2_5-int4"],
+                    {"default": "MiniCPM-V-2_6-int4"},
+                ),
+                "keep_model_loaded": ("BOOLEAN", {"default": True}),
+                **sampling_input_types(),
+                "max_slice_nums": (
+                    "INT",
+                    {
+                        "default": 2,
+                    },
+                ),
+                "seed": ("INT", {"default": -1}),
+            },
+            "optional": {
+                "session": ("SESSION",),
+                "images": ("IMAGE",),
+                "device_mode": (DEVICE_MODES, {"default": "auto"}),
+                "park_on_cpu": ("BOOLEAN", {"default": False}),
+            },
+        }
+
+    RETURN_TYPES = ("STRING", "SESSION")
+    RETURN_NAMES = ("answer", "session")
+    FUNCTION = "chat"
+    CATEGORY = "Comfyui_MiniCPM-V-2_6-int4"
+
+    def chat(
+        self,
+        text,
+        model,
+        keep_model_loaded,
+        top_p,
+        top_k,
+        temperature,
+        repetition_penalty,
+        max_new_tokens,
+        max_slice_nums,
+        seed,
+        session=None,
+        images=None,
+        device_mode="auto",
+        park_on_cpu=False,
+    ):
+        if seed != -1:
+            torch.manual_seed(seed)
+        session = session or ChatSession()
+
+        sampling = sampling_kwargs(
+            top_p, top_k, temperature, repetition_penalty, max_new_tokens
+        )
+        with acquired_model(self, model, device_mode, keep_model_loaded, park_on_cpu) as model_entry:
+            with torch.no_grad():
+                content = [text]
+                if images is not None:
+                    with stage("preprocess"):
+                        content = (
+                            model_images(model_entry.model, self.model_checkpoint, images)
+                            + content
+                        )
+                msgs = session.messages + [{"role": "user", "content": content}]
+
+                if supports_kv_reuse(model_entry.model):
+                    answer = self.generate(
+                        model_entry,
+                        session.session_id,
+                        msgs,
+                        max_slice_nums,
+                        do_sample=True,
+                        **sampling,
+                    )
+                else:
+                    answer = run_chat(
+                        model_entry.model,
+                        model_entry.tokenizer,
+                        msgs,
+                        use_image_id=False,
+                        max_slice_nums=max_slice_nums,
+                        **sampling,
+                    )
+
+        return (answer, session.extend(content, answer))
+
+    def generate(self, model_entry, session_id, msgs, max_slice_nums, **generation_kwargs):
+        inputs = build_inputs(
+            model_entry.model, self.model_checkpoint, msgs, max_slice_nums
+        )
+        state = session_store.take(session_id, model_entry)
+        cache, cached_length = None, 0
+        if state is not None:
+            cache = state.cache
+            cached_length = common_prefix_length(
+                state.token_ids, inputs["input_ids"][0].cpu()
+            )
+        print(
+            f"Session {session_id[:8]}: reusing {cached_length} of "
+            f"{inputs['input_ids'].shape[1]} prompt tokens"
+        )
+        answer, cache, token_ids = generate_with_cache(
+            model_entry.model,
+            model_entry.tokenizer,
+            inputs,
+            cache,
+            cached_length,
+            **generation_kwargs,
+        )
+        session_store.put(session_id, SessionState(model_entry, cache, token_ids))
+        return answer
@@ -0,0 +1,133 @@
+import torch
+from .model_registry import DEVICE_MODES
+from .generation_utils import run_chat
+from .video_utils import open_video_windows, decode_frames, format_timestamp, video_pool
+from .vqa_core import sampling_input_types, sampling_kwargs, acquired_model
+
+DEFAULT_REDUCE_PROMPT = (
+    "The following are timestamped descriptions of consecutive segments of one "
+    "video. Combine them into a single coherent answer to this request: {text}"
+)
+
+
+class MiniCPM_Long_Video_VQA:
+    def __init__(self):
+        self.model_checkpoint = None
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "source_video_path": ("PATH",),
+                "text": ("STRING", {"default": "Describe this video.", "multiline": True}),
+                "reduce_prompt": (
+                    "STRING",
+                    {"default": DEFAULT_REDUCE_PROMPT, "multiline": True},
+                ),  # {text} is replaced by the request above
+                "model": (
+                    ["MiniCPM-V-2_6-int4", "MiniCPM-Llama3-V-2_5-int4"],
+                    {"default": "MiniCPM-V-2_6-int4"},
+                ),
+                "keep_model_loaded": ("BOOLEAN", {"default": False}),
+                **sampling_input_types(512),
+                "window_seconds": ("FLOAT", {"default": 30.0, "min": 1.0}),
+                "window_max_num_frames": (
+                    "INT",
+                    {
+                        "default": 16,
+                    },
+                ),  # bounds the peak memory of every window
+                "video_max_slice_nums": (
+                    "INT",
+                    {
+                        "default": 1,
+                    },
+                ),
+                "reduce_group_size": ("INT", {"default": 16, "min": 2}),
+                "seed": ("INT", {"default": -1}),
+            },
+            "optional": {
+                "device_mode": (DEVICE_MODES, {"default": "auto"}),
+                "park_on_cpu": ("BOOLEAN", {"default": False}),
+            },
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("summary", "segments")
+    FUNCTION = "inference"
+    CATEGORY = "Comfyui_MiniCPM-V-2_6-int4"
+
+    def inference(
+        self,
+        source_video_path,
+        text,
+        reduce_prompt,
+        model,
+        keep_model_loaded,
+        top_p,
+        top_k,
+        temperature,
+        repetition_penalty,
+        max_new_tokens,
+        window_seconds,
+        window_max_num_frames,
+        video_max_slice_nums,
+        reduce_group_size,
+        seed,
+        device_mode="auto",
+        park_on_cpu=False,
+    ):
+        if seed != -1:
+            torch.manual_seed(seed)
+        vr, windows = open_video_windows(
+            source_video_path, window_seconds, window_max_num_frames, video_max_slice_nums
+        )
+        if not windows:
+            raise ValueError(f"No frames found in {source_video_path}")
+
+        chat_kwargs = dict(
+            sampling_kwargs(top_p, top_k, temperature, repetition_penalty, max_new_tokens),
+            use_image_id=False,
+            max_slice_nums=video_max_slice_nums,
+        )
+        with acquired_model(self, model, device_mode, keep_model_loaded, park_on_cpu) as model_entry:
+            with torch.no_grad():
+                # map: describe every window, decoding the next one meanwhile so
+                # only two windows of frames are ever in memory
+                segments = []
+                pending = video_pool.submit(decode_frames, vr, windows[0][2])
+                for i, (start, end, _) in enumerate(windows):
+                    frames = pending.result()
+                    if i + 1 < len(windows):
+                        pending = video_pool.submit(decode_frames, vr, windows[i + 1][2])
+                    msgs = [{"role": "user", "content": frames + [text]}]
+                    answer = run_chat(
+                        model_entry.model, model_entry.tokenizer, msgs, **chat_kwargs
+                    )
+                    del frames, msgs
+                    segments.append(
+                        f"[{format_timestamp(start)}-{format_timestamp(end)}] {answer.strip()}"
+                    )
+                    print(f"Window {i + 1}/{len(windows)} done")
+
+                # reduce: merge the descriptions group by group until one remains
+                summaries = segments
+                while len(summaries) > 1:
+                    summaries = [
+                        self.reduce(
+                            model_entry,
+                            reduce_prompt.replace("{text}", text),
+                            summaries[j : j + reduce_group_size],
+                            chat_kwargs,
+                        )
+                        for j in range(0, len(summaries), reduce_group_size)
+                    ]
+                summary = summaries[0] if len(segments) > 1 else segments[0].split("] ", 1)[1]
+
+        return (summary, "\n".join(segments))
+
+    def reduce(self, model_entry, prompt, descriptions, chat_kwargs):
+        msgs = [{"role": "user", "content": [prompt + "\n\n" + "\n".join(descriptions)]}]
+        return run_chat(
+            model_entry.model, model_entry.tokenizer, msgs, **chat_kwargs
+        ).strip()
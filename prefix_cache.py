@@ -0,0 +1,84 @@
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+from .model_registry import registry
+from .kv_generation import cache_nbytes, crop_cache
+from .profiling import stage, record
+
+
+class PrefixState:
+    """Token ids of a system prompt and the key/values they prefill."""
+
+    def __init__(self, token_ids, cache):
+        self.token_ids = token_ids
+        self.cache = cache
+        self.size = cache_nbytes(cache)
+
+    def crop(self, length):
+        crop_cache(self.cache, length)
+        self.token_ids = self.token_ids[:length]
+        self.size = cache_nbytes(self.cache)
+
+
+def prefill_prefix(model, tokenizer, system_prompt):
+    """Tokenize and prefill the system block of the chat template."""
+    from transformers import DynamicCache
+
+    text = tokenizer.apply_chat_template(
+        [{"role": "system", "content": system_prompt}], tokenize=False
+    )
+    token_ids = torch.tensor(tokenizer.encode(text, add_special_tokens=False))
+    cache = DynamicCache()
+    with stage("prefix_prefill"):
+        inputs_embeds = model.llm.get_input_embeddings()(token_ids.to(model.device)[None])
+        model.llm.model(inputs_embeds=inputs_embeds, past_key_values=cache, use_cache=True)
+    return PrefixState(token_ids, cache)
+
+
+class PrefixCache:
+    """Bounded LRU of prefilled system prompts per (model, prompt).
+
+    A state is taken out while a request extends it and put back cropped to
+    the prefix, so concurrent requests never share one cache. The states of a
+    model are dropped when it is unloaded or parked.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._states = OrderedDict()  # (id(model), prompt) -> (model, state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        max_mb = float(os.environ.get("MINICPM_PREFIX_CACHE_MB", 1024))
+        return cls(int(max_mb * 1024**2))
+
+    def take(self, model, tokenizer, system_prompt):
+        with self._lock:
+            item = self._states.pop((id(model), system_prompt), None)
+        record("prefix_cache", "miss" if item is None else "hit")
+        if item is None:
+            return prefill_prefix(model, tokenizer, system_prompt)
+        return item[1]
+
+    def put(self, model, system_prompt, state):
+        if state.size > self.max_bytes:
+            return
+        with self._lock:
+            self._states[(id(model), system_prompt)] = (model, state)
+            total = sum(s.size for _, s in self._states.values())
+            while total > self.max_bytes:
+                _, (_, old) = self._states.popitem(last=False)
+                total -= old.size
+
+    def drop_model(self, model_entry):
+        with self._lock:
+            for key, (model, _) in list(self._states.items()):
+                if model is model_entry.model:
+                    del self._states[key]
+
+
+prefix_cache = PrefixCache.from_env()
+registry.add_unload_listener(prefix_cache.drop_model)
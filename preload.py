@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+
+import torch
+from PIL import Image
+from .model_registry import registry, load_settings
+from .generation_utils import run_chat
+
+
+def preload_config():
+    """Models to load at startup, read from the environment.
+
+    MINICPM_PRELOAD: comma separated model names, e.g. "MiniCPM-V-2_6-int4"
+    MINICPM_PRELOAD_DEVICE_MODE: device mode to load them with (default "auto")
+    MINICPM_PRELOAD_WARMUP: run a tiny generation after loading (default 1)
+    """
+    models = [m.strip() for m in os.environ.get("MINICPM_PRELOAD", "").split(",")]
+    return {
+        "models": [m for m in models if m],
+        "device_mode": os.environ.get("MINICPM_PRELOAD_DEVICE_MODE", "auto"),
+        "warmup": os.environ.get("MINICPM_PRELOAD_WARMUP", "1") != "0",
+    }
+
+
+def warm_up(model_entry):
+    """Run one short image question so kernels are compiled before the first request."""
+    msgs = [{"role": "user", "content": [Image.new("RGB", (448, 448)), "Hi"]}]
+    with torch.no_grad():
+        run_chat(
+            model_entry.model,
+            model_entry.tokenizer,
+            msgs,
+            max_new_tokens=4,
+            use_image_id=False,
+            max_slice_nums=1,
+        )
+
+
+def preload(models, device_mode="auto", warmup=True):
+    for model in models:
+        start = time.perf_counter()
+        try:
+            model_checkpoint, torch_dtype, mode = load_settings(model, device_mode)
+            # same key as the VQA nodes use, so their first run finds it loaded;
+            # a node acquiring it during the warm-up waits for it to finish
+            model_entry = registry.acquire(
+                model_checkpoint,
+                torch_dtype,
+                attn_implementation="sdpa",
+                device_mode=mode,
+                warm_up=warm_up if warmup else None,
+            )
+            registry.release(model_entry, keep_loaded=True)
+        except Exception as e:
+            print(f"Preloading {model} failed: {e}")
+            continue
+        print(f"Preloaded {model} in {time.perf_counter() - start:.1f}s")
+
+
+def start_preload():
+    """Start loading the configured models on a daemon thread, if any."""
+    config = preload_config()
+    if not config["models"]:
+        return None
+    thread = threading.Thread(
+        target=preload, kwargs=config, name="minicpm-preload", daemon=True
+    )
+    thread.start()
+    return thread
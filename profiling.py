@@ -0,0 +1,168 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+import torch
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+_local = threading.local()
+_log = None
+_log_lock = threading.Lock()
+
+
+class RunMetrics:
+    """Stage timings (seconds) and counters gathered during one node run."""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record(self, name, value):
+        with self._lock:
+            self.counters[name] = value
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, other):
+        """Add the stages and counters of `other`, e.g. work shared with another run."""
+        with other._lock:
+            stages, counters = dict(other.stages), dict(other.counters)
+        for name, seconds in stages.items():
+            self.add_stage(name, seconds)
+        with self._lock:
+            self.counters.update(counters)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "stages": {name: round(s, 4) for name, s in self.stages.items()},
+                **self.counters,
+            }
+
+    def summary(self, node, total):
+        """`to_dict` plus the run's total time, tokens/sec and peak VRAM."""
+        summary = {"node": node, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        summary.update(self.to_dict())
+        summary["total"] = round(total, 4)
+        generate = self.stages.get("generate")
+        if generate and "generated_tokens" in self.counters:
+            summary["tokens_per_second"] = round(
+                self.counters["generated_tokens"] / generate, 2
+            )
+        if torch.cuda.is_available():
+            summary["peak_vram_mb"] = round(torch.cuda.max_memory_allocated() / 1024**2, 1)
+        return summary
+
+
+def current():
+    return getattr(_local, "metrics", None)
+
+
+@contextmanager
+def collect(metrics=None):
+    """Collect the stages and counters recorded by this thread into `metrics`."""
+    previous = current()
+    _local.metrics = metrics if metrics is not None else RunMetrics()
+    try:
+        yield _local.metrics
+    finally:
+        _local.metrics = previous
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = current()
+        if metrics is not None:
+            metrics.add_stage(name, time.perf_counter() - start)
+
+
+def record(name, value):
+    metrics = current()
+    if metrics is not None:
+        metrics.record(name, value)
+
+
+def increment(name, value=1):
+    metrics = current()
+    if metrics is not None:
+        metrics.increment(name, value)
+
+
+def bind(fn):
+    """Wrap `fn` so it records into the caller's metrics when run on another thread."""
+    metrics = current()
+    if metrics is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with collect(metrics):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def _metrics_log():
+    """JSON lines log of every node run, rotated at `MINICPM_METRICS_LOG_MB`."""
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = logging.getLogger("minicpm.metrics")
+            _log.setLevel(logging.INFO)
+            _log.propagate = False
+            path = os.environ.get(
+                "MINICPM_METRICS_LOG", os.path.join(current_dir, "cache", "metrics.log")
+            )
+            if path:  # an empty path disables the log
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                max_mb = float(os.environ.get("MINICPM_METRICS_LOG_MB", 10))
+                _log.addHandler(
+                    RotatingFileHandler(
+                        path, maxBytes=int(max_mb * 1024**2), backupCount=3, encoding="utf-8"
+                    )
+                )
+            else:
+                _log.addHandler(logging.NullHandler())
+    return _log
+
+
+class NodeRun:
+    summary = None
+
+
+@contextmanager
+def node_run(node):
+    """Collect the metrics of one run of `node` and append them to the metrics log.
+
+    The summary is available as `.summary` of the yielded object once the
+    block completes.
+    """
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    run = NodeRun()
+    with collect() as metrics:
+        start = time.perf_counter()
+        yield run
+        run.summary = metrics.summary(node, time.perf_counter() - start)
+    _metrics_log().info(json.dumps(run.summary))
+
+
+def node_output(run, *result):
+    """Node return value carrying `result`, the metrics as JSON and a UI payload."""
+    return {"ui": {"metrics": [run.summary]}, "result": (*result, json.dumps(run.summary))}
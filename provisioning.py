@@ -0,0 +1,313 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_NAME = ".minicpm_manifest.json"
+CHUNK_SIZE = 1024**2
+
+_locks = {}
+_locks_guard = threading.Lock()
+_complete = set()
+
+
+class ProvisioningConfig:
+    """Where and how checkpoints are fetched.
+
+    `endpoint` serves the Hugging Face Hub API, so a mirror or a local HTTP
+    server with the same layout works too:
+    `{endpoint}/api/models/{repo}/revision/{revision}?blobs=true` lists the
+    files and `{endpoint}/{repo}/resolve/{revision}/{path}` serves them.
+    """
+
+    def __init__(self, endpoint, revision="main", token=None, workers=8, retries=5, offline=False):
+        self.endpoint = endpoint.rstrip("/")
+        self.revision = revision
+        self.token = token
+        self.workers = workers
+        self.retries = retries
+        self.offline = offline
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.environ.get("MINICPM_MODEL_ENDPOINT")
+            or os.environ.get("HF_ENDPOINT", "https://huggingface.co"),
+            revision=os.environ.get("MINICPM_MODEL_REVISION", "main"),
+            token=os.environ.get("HF_TOKEN"),
+            workers=int(os.environ.get("MINICPM_DOWNLOAD_WORKERS", 8)),
+            retries=int(os.environ.get("MINICPM_DOWNLOAD_RETRIES", 5)),
+            offline=os.environ.get("HF_HUB_OFFLINE", "0") not in ("0", ""),
+        )
+
+    def headers(self):
+        headers = {"User-Agent": "ComfyUI_MiniCPM-V-2_6-int4"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        return headers
+
+    def file_url(self, repo_id, path):
+        return "/".join(
+            [self.endpoint, repo_id, "resolve", urllib.parse.quote(self.revision, safe=""),
+             urllib.parse.quote(path)]
+        )
+
+
+def list_repo_files(config, repo_id):
+    """{path: {"size", "sha256" or "sha1"}} of every file of `repo_id` at the configured revision."""
+    url = (
+        f"{config.endpoint}/api/models/{repo_id}/revision/"
+        f"{urllib.parse.quote(config.revision, safe='')}?blobs=true"
+    )
+    request = urllib.request.Request(url, headers=config.headers())
+    with urllib.request.urlopen(request, timeout=30) as response:
+        info = json.load(response)
+    files = {}
+    for sibling in info.get("siblings", []):
+        lfs = sibling.get("lfs")
+        if lfs:
+            files[sibling["rfilename"]] = {"size": lfs["size"], "sha256": lfs["sha256"]}
+        else:
+            # small files are checked against their git blob id
+            files[sibling["rfilename"]] = {"size": sibling.get("size"), "sha1": sibling.get("blobId")}
+    return files
+
+
+def file_digest(path, expected):
+    """Hex digest of `path` in the format of `expected` (LFS sha256 or git blob sha1)."""
+    if "sha256" in expected:
+        digest = hashlib.sha256()
+    else:
+        digest = hashlib.sha1(b"blob %d\0" % os.path.getsize(path))
+    with open(path, "rb") as f:
+        while chunk := f.read(8 * CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verified(path, expected):
+    if not os.path.isfile(path):
+        return False
+    if expected.get("size") is not None and os.path.getsize(path) != expected["size"]:
+        return False
+    checksum = expected.get("sha256") or expected.get("sha1")
+    return checksum is None or file_digest(path, expected) == checksum
+
+
+def download_file(config, url, dest, expected):
+    """Download `url` to `dest`, resuming a previous partial download, and verify it."""
+    partial = dest + ".incomplete"
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    for attempt in range(config.retries + 1):
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        size = expected.get("size")
+        if size is not None and offset > size:
+            os.remove(partial)
+            offset = 0
+        headers = config.headers()
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        try:
+            if size is None or offset < size:
+                request = urllib.request.Request(url, headers=headers)
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    # a server ignoring the range sends the whole file again
+                    mode = "ab" if offset and response.status == 206 else "wb"
+                    with open(partial, mode) as f:
+                        while chunk := response.read(CHUNK_SIZE):
+                            f.write(chunk)
+        except urllib.error.HTTPError as e:
+            if e.code == 416:  # nothing left to fetch
+                pass
+            elif e.code < 500 and e.code != 429:
+                raise
+            else:
+                print(f"Download of {url} failed ({e}), retrying")
+                time.sleep(min(2**attempt, 30))
+                continue
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Download of {url} failed ({e}), retrying")
+            time.sleep(min(2**attempt, 30))
+            continue
+        if verified(partial, expected):
+            os.replace(partial, dest)
+            return
+        # corrupt data cannot be resumed, start this file over
+        print(f"Checksum mismatch for {url}, downloading it again")
+        os.remove(partial)
+    raise RuntimeError(f"Could not download {url} after {config.retries + 1} attempts")
+
+
+def read_manifest(model_checkpoint):
+    try:
+        with open(os.path.join(model_checkpoint, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(model_checkpoint, manifest):
+    path = os.path.join(model_checkpoint, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def is_complete(model_checkpoint):
+    """Whether `model_checkpoint` holds every file of its manifest with the recorded size."""
+    if model_checkpoint in _complete:
+        return True
+    manifest = read_manifest(model_checkpoint)
+    if not manifest or not manifest.get("complete"):
+        return False
+    for path, info in manifest["files"].items():
+        path = info.get("converted_to", path)
+        size = None if "converted_to" in info else info.get("size")
+        full_path = os.path.join(model_checkpoint, path)
+        if not os.path.isfile(full_path):
+            return False
+        if size is not None and os.path.getsize(full_path) != size:
+            return False
+    _complete.add(model_checkpoint)
+    return True
+
+
+def _usable_unverified(model_checkpoint):
+    """Whether `model_checkpoint` may be used without the endpoint.
+
+    Only folders we never provisioned (no manifest) qualify; ours has a
+    manifest, so it is unusable if is_complete already said no.
+    """
+    return os.path.isdir(model_checkpoint) and read_manifest(model_checkpoint) is None
+
+
+def _checkpoint_lock(model_checkpoint):
+    with _locks_guard:
+        return _locks.setdefault(model_checkpoint, threading.Lock())
+
+
+def provision(repo_id, model_checkpoint, config=None):
+    """Make `model_checkpoint` a complete, verified copy of `repo_id`.
+
+    Missing files are fetched in parallel, partial files are resumed, and each
+    file is verified against its checksum before it is recorded in the
+    manifest, so an interrupted download picks up where it stopped. Files of
+    an existing download without a manifest are verified and kept. `.bin`
+    weights are converted to safetensors once at the end.
+    """
+    config = config or ProvisioningConfig.from_env()
+    with _checkpoint_lock(model_checkpoint):
+        if is_complete(model_checkpoint):
+            return model_checkpoint
+        if config.offline:
+            if _usable_unverified(model_checkpoint):
+                print("Offline mode, using unverified checkpoint:", model_checkpoint)
+                _complete.add(model_checkpoint)
+                return model_checkpoint
+            raise RuntimeError(
+                f"{model_checkpoint} is missing or partly downloaded and HF_HUB_OFFLINE is set"
+            )
+        try:
+            files = list_repo_files(config, repo_id)
+        except (urllib.error.URLError, OSError) as e:
+            if _usable_unverified(model_checkpoint):
+                print(f"Cannot verify {model_checkpoint} ({e}), using it as is")
+                # don't wait for the endpoint again on every load of this process
+                _complete.add(model_checkpoint)
+                return model_checkpoint
+            if os.path.isdir(model_checkpoint):
+                raise RuntimeError(
+                    f"{model_checkpoint} is partly downloaded and {config.endpoint} is unreachable ({e})"
+                ) from e
+            raise
+
+        os.makedirs(model_checkpoint, exist_ok=True)
+        manifest = read_manifest(model_checkpoint) or {}
+        if manifest.get("repo_id") != repo_id or manifest.get("revision") != config.revision:
+            manifest = {"repo_id": repo_id, "revision": config.revision, "files": {}}
+        manifest["complete"] = False
+        manifest_lock = threading.Lock()
+
+        def fetch(path):
+            expected = files[path]
+            dest = os.path.join(model_checkpoint, path)
+            recorded = manifest["files"].get(path)
+            if (
+                recorded == expected
+                and os.path.isfile(dest)
+                and expected.get("size") in (None, os.path.getsize(dest))
+            ):
+                return
+            if not verified(dest, expected):
+                print("Downloading:", f"{repo_id}/{path}")
+                download_file(config, config.file_url(repo_id, path), dest, expected)
+            with manifest_lock:
+                manifest["files"][path] = expected
+                write_manifest(model_checkpoint, manifest)
+
+        todo = [p for p in files if "converted_to" not in manifest["files"].get(p, {})]
+        with ThreadPoolExecutor(config.workers, thread_name_prefix="minicpm-download") as pool:
+            # consume the results so the first failure is raised here
+            list(pool.map(fetch, todo))
+
+        convert_to_safetensors(model_checkpoint, manifest)
+        manifest["complete"] = True
+        write_manifest(model_checkpoint, manifest)
+        print("Checkpoint verified:", model_checkpoint)
+        return model_checkpoint
+
+
+def convert_to_safetensors(model_checkpoint, manifest):
+    """Convert `.bin` weights to safetensors, which `from_pretrained` memory-maps instead of copying."""
+    bins = sorted(
+        path
+        for path, info in manifest["files"].items()
+        if path.endswith(".bin") and "/" not in path and "converted_to" not in info
+    )
+    if not bins:
+        return
+    import torch
+    from safetensors.torch import save_file
+
+    for path in bins:
+        name = path.replace("pytorch_model", "model")[: -len(".bin")] + ".safetensors"
+        print("Converting to safetensors:", path)
+        try:
+            state_dict = torch.load(
+                os.path.join(model_checkpoint, path), map_location="cpu", mmap=True, weights_only=True
+            )
+        except RuntimeError:  # legacy (non zip) files cannot be memory-mapped
+            state_dict = torch.load(
+                os.path.join(model_checkpoint, path), map_location="cpu", weights_only=True
+            )
+        # safetensors does not store tensors sharing memory (tied weights)
+        seen = set()
+        for key, tensor in state_dict.items():
+            storage = tensor.untyped_storage().data_ptr()
+            state_dict[key] = tensor.clone() if storage in seen else tensor.contiguous()
+            seen.add(storage)
+        dest = os.path.join(model_checkpoint, name)
+        save_file(state_dict, dest + ".tmp", metadata={"format": "pt"})
+        os.replace(dest + ".tmp", dest)
+        del state_dict
+        os.remove(os.path.join(model_checkpoint, path))
+        manifest["files"][path]["converted_to"] = name
+        write_manifest(model_checkpoint, manifest)
+
+    index = os.path.join(model_checkpoint, "pytorch_model.bin.index.json")
+    if "pytorch_model.bin.index.json" in manifest["files"] and os.path.exists(index):
+        with open(index, encoding="utf-8") as f:
+            weight_map = json.load(f)
+        weight_map["weight_map"] = {
+            key: manifest["files"][shard]["converted_to"]
+            for key, shard in weight_map["weight_map"].items()
+        }
+        with open(os.path.join(model_checkpoint, "model.safetensors.index.json"), "w", encoding="utf-8") as f:
+            json.dump(weight_map, f, indent=2)
+        os.remove(index)
+        manifest["files"]["pytorch_model.bin.index.json"]["converted_to"] = "model.safetensors.index.json"
@@ -0,0 +1,62 @@
+import os
+
+from .video_utils import submit_encode_video
+
+VQA_NODES = ("MiniCPM_VQA", "MiniCPM_VQA_Polished")
+
+
+def queued_videos(limit):
+    """Video and decode settings of the VQA nodes in the next queued prompts.
+
+    Only videos coming straight from a LoadVideo node with literal decode
+    settings are known before the prompt runs.
+    """
+    from server import PromptServer
+
+    _, pending = PromptServer.instance.prompt_queue.get_current_queue()
+    for item in sorted(pending, key=lambda item: item[0])[:limit]:
+        prompt = item[2]
+        for node in prompt.values():
+            if node.get("class_type") not in VQA_NODES:
+                continue
+            inputs = node.get("inputs", {})
+            link = inputs.get("source_video_path")
+            if not isinstance(link, list):
+                continue
+            source = prompt.get(str(link[0]), {})
+            if source.get("class_type") != "LoadVideo":
+                continue
+            params = (
+                source.get("inputs", {}).get("video"),
+                inputs.get("video_max_num_frames", 64),
+                inputs.get("video_sampling", "uniform"),
+                inputs.get("video_max_slice_nums", 2),
+                inputs.get("dedup_threshold", 0.0),
+                inputs.get("dedup_refill", True),
+            )
+            if not any(isinstance(p, list) or p is None for p in params):
+                yield params
+
+
+def prefetch_queued_videos():
+    """Start decoding the videos of the next queued prompts into the frame cache.
+
+    Called while the current prompt generates on the GPU, so the decode of the
+    next one overlaps with it. `MINICPM_PREFETCH_PROMPTS` (default 1) sets how
+    many queued prompts are looked at, 0 disables prefetching.
+    """
+    limit = int(os.environ.get("MINICPM_PREFETCH_PROMPTS", 1))
+    if limit <= 0:
+        return
+    try:
+        from server import PromptServer  # noqa: F401
+        from .util_nodes import video_index
+    except ImportError:  # outside ComfyUI, e.g. in benchmark.py
+        return
+    try:
+        for video, *params in queued_videos(limit):
+            path = video_index.resolve(video)
+            if path is not None:
+                submit_encode_video(path, *params, bind_metrics=False)
+    except Exception as e:  # a prefetch must never fail the running prompt
+        print("Prefetching queued videos failed:", e)
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def hash_tensor(tensor):
+    h = hashlib.sha256()
+    h.update(f"{tuple(tensor.shape)}{tensor.dtype}".encode())
+    h.update(tensor.detach().cpu().contiguous().numpy().data)
+    return h.hexdigest()
+
+
+_file_hashes = {}
+
+
+def hash_file(path, chunk_size=1 << 20):
+    # memoized on (size, mtime) so an unchanged video is only read once per process
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _file_hashes.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+        digest = _file_hashes[memo_key] = h.hexdigest()
+    return digest
+
+
+def response_key(model, text, images=(), video_path=None, **params):
+    """Build the cache key of a VQA request from its inputs and sampling params."""
+    parts = {
+        "model": model,
+        "text": text,
+        "images": [hash_tensor(image) for image in images if image is not None],
+        "video": hash_file(video_path) if video_path else None,
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded, disk-backed store of generated answers.
+
+    Entries live in a single SQLite file and the least recently read ones are
+    dropped once the stored text exceeds `max_bytes`.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @classmethod
+    def from_env(cls):
+        path = os.environ.get(
+            "MINICPM_RESPONSE_CACHE", os.path.join(current_dir, "cache", "responses.db")
+        )
+        max_mb = float(os.environ.get("MINICPM_RESPONSE_CACHE_MB", 64))
+        return cls(path, int(max_mb * 1024**2))
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_access REAL)"
+            )
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        size = len(value.encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                rows = conn.execute(
+                    "SELECT key, size FROM responses ORDER BY last_access"
+                ).fetchall()
+                evicted = []
+                for old_key, old_size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((old_key,))
+                    total -= old_size
+                conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+response_cache = ResponseCache.from_env()
@@ -0,0 +1,202 @@
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+
+from .model_registry import registry, get_model_checkpoint
+from .generation_utils import run_chat, StopStringCriteria, CallbackStreamer
+from .kv_generation import (
+    supports_kv_reuse,
+    build_inputs,
+    common_prefix_length,
+    generate_with_cache,
+)
+from .prefix_cache import prefix_cache
+from .profiling import record
+
+DECODING_MODES = ["default", "prompt_lookup", "draft_model"]
+
+# small models sharing the vocabulary of the language model of each checkpoint
+DRAFT_MODELS = {
+    "MiniCPM-V-2_6": "Qwen/Qwen2-0.5B-Instruct",
+}
+
+_drafts = weakref.WeakKeyDictionary()
+_drafts_lock = threading.Lock()
+
+
+def draft_repo(model_checkpoint):
+    repo_id = os.environ.get("MINICPM_DRAFT_MODEL")
+    if repo_id:
+        return repo_id
+    name = os.path.basename(model_checkpoint)
+    for prefix, repo_id in DRAFT_MODELS.items():
+        if name.startswith(prefix):
+            return repo_id
+    raise ValueError(f"No draft model known for {name}, set MINICPM_DRAFT_MODEL")
+
+
+def draft_model(model, model_checkpoint):
+    """Return the (draft model, tokenizer) proposing tokens for `model`, loaded on first use."""
+    with _drafts_lock:
+        draft = _drafts.get(model)
+        if draft is None:
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+
+            repo_id = draft_repo(model_checkpoint)
+            checkpoint = get_model_checkpoint(os.path.basename(repo_id), repo_id)
+            print("Loading draft model:", checkpoint)
+            draft = (
+                AutoModelForCausalLM.from_pretrained(
+                    checkpoint, torch_dtype=model.dtype, low_cpu_mem_usage=True
+                )
+                .to(model.device)
+                .eval(),
+                AutoTokenizer.from_pretrained(checkpoint),
+            )
+            _drafts[model] = draft
+        return draft
+
+
+def _drop_draft(model_entry):
+    # the draft lives on the device of its model, it goes when the model is unloaded or parked
+    with _drafts_lock:
+        _drafts.pop(model_entry.model, None)
+
+
+registry.add_unload_listener(_drop_draft)
+
+
+def decoding_kwargs(decoding, model, tokenizer, model_checkpoint):
+    """Extra `generate` kwargs of a decoding mode."""
+    if decoding == "prompt_lookup":
+        num_tokens = int(os.environ.get("MINICPM_PROMPT_LOOKUP_TOKENS", 10))
+        return {"prompt_lookup_num_tokens": num_tokens}
+    if decoding == "draft_model":
+        assistant_model, assistant_tokenizer = draft_model(model, model_checkpoint)
+        # the draft's tokenizer lacks the image tokens, so tokens are matched as
+        # text instead of comparing logits (transformers >= 4.46)
+        return {
+            "assistant_model": assistant_model,
+            "tokenizer": tokenizer,
+            "assistant_tokenizer": assistant_tokenizer,
+        }
+    return {}
+
+
+@contextmanager
+def track_acceptance(llm):
+    """Count the draft tokens proposed and accepted by the assisted `generate` calls in the block."""
+    stats = {"proposed": 0, "accepted": 0}
+    get_candidate_generator = llm._get_candidate_generator
+
+    def counting_candidate_generator(*args, **kwargs):
+        generator = get_candidate_generator(*args, **kwargs)
+        get_candidates = generator.get_candidates
+        update_candidate_strategy = generator.update_candidate_strategy
+
+        def counted_get_candidates(input_ids):
+            candidate_ids, candidate_logits = get_candidates(input_ids)
+            stats["proposed"] += candidate_ids.shape[1] - input_ids.shape[1]
+            return candidate_ids, candidate_logits
+
+        def counted_update(input_ids, scores, num_matches):
+            stats["accepted"] += int(num_matches)
+            return update_candidate_strategy(input_ids, scores, num_matches)
+
+        generator.get_candidates = counted_get_candidates
+        generator.update_candidate_strategy = counted_update
+        return generator
+
+    llm._get_candidate_generator = counting_candidate_generator
+    try:
+        yield stats
+    finally:
+        del llm._get_candidate_generator  # drop the instance override
+        record("draft_tokens_proposed", stats["proposed"])
+        record("draft_tokens_accepted", stats["accepted"])
+        if stats["proposed"]:
+            record("acceptance_rate", round(stats["accepted"] / stats["proposed"], 3))
+
+
+def assisted_chat(
+    model,
+    tokenizer,
+    msgs,
+    decoding,
+    model_checkpoint,
+    stream=False,
+    stop_string="",
+    on_text=None,
+    max_slice_nums=2,
+    use_image_id=False,
+    vision_hidden_states=None,
+    system_prompt="",
+    **sampling,
+):
+    """`run_chat` with assisted decoding and a cached system prompt prefill.
+
+    With prompt lookup or draft model decoding, candidate tokens are only kept
+    when the model itself would have produced them, so answers follow the
+    same distribution as `run_chat`. The key/values of `system_prompt` are
+    prefilled once per model and reused by every request sharing it. Both
+    build the prompt with MiniCPM-V 2.6's processor; models without one fall
+    back to `run_chat` with default decoding.
+    """
+    if not supports_kv_reuse(model) or (decoding == "default" and not system_prompt):
+        if decoding != "default":
+            print(f"{decoding} decoding needs MiniCPM-V 2.6, using default decoding")
+        # report the mode that actually ran
+        record("decoding", "default")
+        if system_prompt:
+            sampling["system_prompt"] = system_prompt
+        return run_chat(
+            model,
+            tokenizer,
+            msgs,
+            stream=stream,
+            stop_string=stop_string,
+            on_text=on_text,
+            max_slice_nums=max_slice_nums,
+            use_image_id=use_image_id,
+            vision_hidden_states=vision_hidden_states,
+            **sampling,
+        )
+
+    from transformers import StoppingCriteriaList
+
+    record("decoding", decoding)
+    generation_kwargs = decoding_kwargs(decoding, model, tokenizer, model_checkpoint)
+    inputs = build_inputs(model, model_checkpoint, msgs, max_slice_nums, system_prompt)
+    if stop_string:
+        prompt_length = inputs["input_ids"].shape[1]
+        generation_kwargs["stopping_criteria"] = StoppingCriteriaList(
+            [StopStringCriteria(tokenizer, stop_string, prompt_length)]
+        )
+    if stream and on_text is not None:
+        generation_kwargs["streamer"] = CallbackStreamer(tokenizer, on_text)
+
+    prefix, cache, cached_length = None, None, 0
+    if system_prompt:
+        prefix = prefix_cache.take(model, tokenizer, system_prompt)
+        cache = prefix.cache
+        cached_length = common_prefix_length(prefix.token_ids, inputs["input_ids"][0].cpu())
+    with track_acceptance(model.llm):
+        result, _, _ = generate_with_cache(
+            model,
+            tokenizer,
+            inputs,
+            cache,
+            cached_length,
+            vision_hidden_states=vision_hidden_states,
+            do_sample=True,
+            **generation_kwargs,
+            **sampling,
+        )
+    if prefix is not None and cached_length == len(prefix.token_ids) < inputs["input_ids"].shape[1]:
+        # generation extended the cache in place, keep only the system prompt
+        prefix.crop(cached_length)
+        prefix_cache.put(model, system_prompt, prefix)
+    if stop_string:
+        result = result.split(stop_string)[0]
+    return result
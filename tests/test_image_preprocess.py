@@ -0,0 +1,77 @@
+"""Checks of the torch image preprocessing against the processor's PIL slicing.
+
+The reference is benchmark.py's `StubImageProcessor`, which has the methods
+and defaults of MiniCPM-V 2.6's `MiniCPMVImageProcessor`. Needs torch, PIL,
+numpy and transformers; run with `python -m unittest discover -s tests`.
+"""
+
+import importlib.util
+import os
+import unittest
+
+try:
+    import numpy  # noqa: F401
+    import PIL  # noqa: F401
+    import torch
+    import transformers  # noqa: F401
+except ImportError:
+    torch = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@unittest.skipIf(torch is None, "needs torch, PIL, numpy and transformers")
+class TensorPreprocessTest(unittest.TestCase):
+    # (height, width): unsliced, upscaled, wide, tall and a 3x3 grid
+    SIZES = [(448, 448), (200, 300), (720, 1280), (1500, 600), (1344, 1344)]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.image_preprocess = load("image_preprocess")
+        cls.processor = load("benchmark").StubImageProcessor()
+
+    def compare(self, height, width, max_slice_nums):
+        image_preprocess = self.image_preprocess
+        torch.manual_seed(height * width)
+        # smooth content, so bicubic resizes of torch and PIL stay close
+        images = torch.nn.functional.interpolate(
+            torch.rand((1, 3, 8, 8)), size=(height, width), mode="bilinear"
+        ).permute([0, 2, 3, 1])
+        tensor_images = image_preprocess.tensor_images(images)
+        pil_images = image_preprocess.to_pil_images(images.permute([0, 3, 1, 2]))
+
+        expected = self.processor.preprocess([pil_images], max_slice_nums=max_slice_nums)
+        actual = image_preprocess.preprocess_tensor_images(
+            self.processor, [tensor_images], max_slice_nums
+        )
+
+        self.assertEqual(actual["image_sizes"], expected["image_sizes"])
+        self.assertEqual(actual["tgt_sizes"][0].tolist(), expected["tgt_sizes"][0].tolist())
+        self.assertEqual(len(actual["pixel_values"][0]), len(expected["pixel_values"][0]))
+        for pixels, reference in zip(actual["pixel_values"][0], expected["pixel_values"][0]):
+            self.assertEqual(pixels.shape, reference.shape)
+            # normalized to [-1, 1]; resampling and uint8 rounding differ slightly
+            self.assertLess((pixels - reference).abs().mean().item(), 0.02)
+
+    def test_matches_processor(self):
+        for height, width in self.SIZES:
+            for max_slice_nums in (1, 2, 9):
+                with self.subTest(size=(height, width), max_slice_nums=max_slice_nums):
+                    self.compare(height, width, max_slice_nums)
+
+    def test_slice_grid(self):
+        # the grid the processor picks decides the number of slices
+        self.assertIsNone(self.processor.get_sliced_grid((448, 448), 9))
+        self.assertEqual(self.processor.get_sliced_grid((1280, 720), 9), [3, 2])
+        self.assertEqual(self.processor.get_sliced_grid((1344, 1344), 9), [3, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Checks of the auto frame/slice budget with the benchmark's stub model.
+
+Needs torch, PIL and numpy; run with `python -m unittest discover -s tests`.
+"""
+
+import importlib
+import importlib.util
+import os
+import sys
+import types
+import unittest
+
+try:
+    import numpy  # noqa: F401
+    import PIL  # noqa: F401
+    import torch
+except ImportError:
+    torch = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_benchmark():
+    spec = importlib.util.spec_from_file_location("benchmark", os.path.join(ROOT, "benchmark.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def images(n, width, height):
+    # fit_budget only looks at the sizes
+    return [types.SimpleNamespace(size=(width, height)) for _ in range(n)]
+
+
+@unittest.skipIf(torch is None, "needs torch, PIL and numpy")
+class FitBudgetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        benchmark = load_benchmark()
+        # memory_budget uses relative imports, load it as part of a bare package
+        package = types.ModuleType(benchmark.PACKAGE)
+        package.__path__ = [ROOT]
+        sys.modules.setdefault(benchmark.PACKAGE, package)
+        cls.memory_budget = importlib.import_module(f"{benchmark.PACKAGE}.memory_budget")
+        cls.model = benchmark.StubModel()
+        cls.tokenizer = benchmark.StubTokenizer()
+
+    def fit(self, content, max_slice_nums, free, droppable=False):
+        memory_budget = self.memory_budget
+        free_memory = memory_budget.free_memory
+        memory_budget.free_memory = lambda device: free
+        try:
+            msgs = [{"role": "user", "content": content + ["Describe this."]}]
+            return memory_budget.fit_budget(
+                self.model, self.tokenizer, msgs, max_slice_nums, 32, droppable
+            )
+        finally:
+            memory_budget.free_memory = free_memory
+
+    def request_bytes(self, slices):
+        return self.memory_budget.request_bytes(self.model, slices, 2, 32)
+
+    def test_raises_slices_up_to_the_model_limit(self):
+        budget = self.fit(images(1, 1344, 1344), 2, free=2**40)
+        self.assertEqual((budget.num_images, budget.max_slice_nums), (1, 9))
+
+    def test_small_images_are_not_given_useless_slices(self):
+        budget = self.fit(images(2, 300, 200), 2, free=2**40)
+        self.assertEqual((budget.num_images, budget.max_slice_nums), (2, 1))
+
+    def test_counts_slices_from_the_resolution(self):
+        count_slices = self.memory_budget.count_slices
+        self.assertEqual(count_slices(self.model, [(448, 448)], 9), 1)
+        self.assertEqual(count_slices(self.model, [(1280, 720)], 9), 7)
+        self.assertEqual(count_slices(self.model, [(1280, 720)] * 2, 2), 6)
+
+    def test_drops_frames_but_never_for_extra_slices(self):
+        frames = images(32, 1280, 720)
+        # room for 8 frames at the requested 2 slices (3 with the thumbnail)
+        budget = self.fit(frames, 2, free=self.request_bytes(8 * 3) / 0.84, droppable=True)
+        self.assertLessEqual(budget.max_slice_nums, 2)
+        self.assertLess(budget.num_images, 32)
+        self.assertGreaterEqual(budget.num_images * (budget.max_slice_nums + 1), 8 * 3)
+
+    def test_keeps_input_images(self):
+        budget = self.fit(images(4, 1280, 720), 2, free=self.request_bytes(4) / 0.84)
+        self.assertEqual((budget.num_images, budget.max_slice_nums), (4, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+"""Checks of the checkpoint downloader against a local HTTP stand-in of the Hub.
+
+provisioning.py only uses the standard library, so it is loaded on its own
+without the package (whose __init__ needs ComfyUI and torch). Run with
+`python -m unittest discover -s tests`.
+"""
+
+import hashlib
+import importlib.util
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location(
+    "provisioning", os.path.join(ROOT, "provisioning.py")
+)
+provisioning = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(provisioning)
+
+WEIGHTS = os.urandom(3 * 1024**2 + 17)
+CONFIG = b'{"model_type": "minicpmv"}\n'
+FILES = {"model.safetensors": WEIGHTS, "sub/config.json": CONFIG}
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Serves the Hub listing and file routes for repo "org/model" at revision "main"."""
+
+    supports_range = True
+    corrupt_responses = 0  # number of file responses to corrupt
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/api/models/org/model/revision/main"):
+            siblings = [
+                {
+                    "rfilename": "model.safetensors",
+                    "size": len(WEIGHTS),
+                    "lfs": {"size": len(WEIGHTS), "sha256": hashlib.sha256(WEIGHTS).hexdigest()},
+                },
+                {
+                    "rfilename": "sub/config.json",
+                    "size": len(CONFIG),
+                    "blobId": hashlib.sha1(b"blob %d\0" % len(CONFIG) + CONFIG).hexdigest(),
+                },
+            ]
+            body = json.dumps({"siblings": siblings}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        path = self.path.split("/resolve/main/", 1)[1]
+        data = FILES[path]
+        requested_range = self.headers.get("Range")
+        type(self).requests.append((path, requested_range))
+        if requested_range and self.supports_range:
+            data = data[int(requested_range.split("=")[1].rstrip("-")) :]
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        if type(self).corrupt_responses:
+            type(self).corrupt_responses -= 1
+            data = bytes(len(data))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ProvisionTest(unittest.TestCase):
+    def setUp(self):
+        StandIn.supports_range = True
+        StandIn.corrupt_responses = 0
+        StandIn.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.config = provisioning.ProvisioningConfig(
+            f"http://127.0.0.1:{self.server.server_port}", retries=1
+        )
+        self.tmp = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.tmp.name, "model")
+        provisioning._complete.clear()
+
+    def tearDown(self):
+        self.stop_server()
+        self.tmp.cleanup()
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def write_partial(self, length):
+        os.makedirs(self.checkpoint, exist_ok=True)
+        path = os.path.join(self.checkpoint, "model.safetensors.incomplete")
+        with open(path, "wb") as f:
+            f.write(WEIGHTS[:length])
+
+    def assert_provisioned(self):
+        for path, data in FILES.items():
+            with open(os.path.join(self.checkpoint, path), "rb") as f:
+                self.assertEqual(f.read(), data)
+        provisioning._complete.clear()
+        self.assertTrue(provisioning.is_complete(self.checkpoint))
+
+    def weight_requests(self):
+        return [r for p, r in StandIn.requests if p == "model.safetensors"]
+
+    def test_resumes_partial_download_with_range(self):
+        self.write_partial(1024**2)
+        provisioning.provision("org/model", self.checkpoint, self.config)
+        self.assert_provisioned()
+        self.assertEqual(self.weight_requests(), [f"bytes={1024**2}-"])
+
+    def test_restarts_when_server_ignores_range(self):
+        StandIn.supports_range = False
+        self.write_partial(1024**2)
+        provisioning.provision("org/model", self.checkpoint, self.config)
+        # a 200 response is the whole file, it must replace the partial one
+        self.assert_provisioned()
+        self.assertEqual(self.weight_requests(), [f"bytes={1024**2}-"])
+
+    def test_downloads_again_on_checksum_mismatch(self):
+        StandIn.corrupt_responses = 1
+        provisioning.provision("org/model", self.checkpoint, self.config)
+        self.assert_provisioned()
+        self.assertEqual(len([p for p, _ in StandIn.requests]), 3)
+
+    def test_truncated_file_is_not_complete(self):
+        provisioning.provision("org/model", self.checkpoint, self.config)
+        provisioning._complete.clear()
+        os.truncate(os.path.join(self.checkpoint, "model.safetensors"), 5)
+        self.assertFalse(provisioning.is_complete(self.checkpoint))
+        provisioning.provision("org/model", self.checkpoint, self.config)
+        self.assert_provisioned()
+
+    def test_unreachable_endpoint_uses_existing_folder_once(self):
+        os.makedirs(self.checkpoint)
+        port = self.server.server_port
+        self.stop_server()
+        config = provisioning.ProvisioningConfig(f"http://127.0.0.1:{port}", retries=0)
+        self.assertEqual(
+            provisioning.provision("org/model", self.checkpoint, config), self.checkpoint
+        )
+        self.assertTrue(provisioning.is_complete(self.checkpoint))
+
+    def test_unreachable_endpoint_refuses_partial_download(self):
+        self.write_partial(1024**2)
+        provisioning.write_manifest(
+            self.checkpoint,
+            {"repo_id": "org/model", "revision": "main", "files": {}, "complete": False},
+        )
+        port = self.server.server_port
+        self.stop_server()
+        for offline in (False, True):
+            config = provisioning.ProvisioningConfig(
+                f"http://127.0.0.1:{port}", retries=0, offline=offline
+            )
+            with self.assertRaises(RuntimeError):
+                provisioning.provision("org/model", self.checkpoint, config)
+            self.assertFalse(provisioning.is_complete(self.checkpoint))
+
+
+if __name__ == "__main__":
+    unittest.main()
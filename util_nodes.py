@@ -1,15 +1,19 @@
 import os
 import folder_paths
+from .video_index import VideoIndex, register_routes
 current_dir = os.path.dirname(os.path.abspath(__file__))
 input_dir = folder_paths.get_input_directory()
 output_dir = folder_paths.get_output_directory()
 
+video_index = VideoIndex.from_env(input_dir)
+register_routes(video_index)
+
 class LoadVideo:
     @classmethod
     def INPUT_TYPES(s):
-        files = [f for f in os.listdir(input_dir) if os.path.isfile(os.path.join(input_dir, f)) and f.split('.')[-1] in ["mp4", "mkv", "mov", "avi", "flv", "wmv", "webm", "m4v"]]
+        # the file list is paged in by web/js/uploadVideo.js from /minicpm/videos
         return {"required":{
-            "video":(files,),
+            "video":([],),
         }}
     
     CATEGORY = "Comfyui_MiniCPM-V-2_6-int4"
@@ -21,8 +25,20 @@ class LoadVideo:
 
     FUNCTION = "load_video"
 
+    @classmethod
+    def VALIDATE_INPUTS(s, video):
+        # replaces ComfyUI's check against the (empty) list of options
+        if video_index.resolve(video) is None:
+            return f"Invalid video file: {video}"
+        return True
+
+    @classmethod
+    def IS_CHANGED(s, video):
+        path = video_index.resolve(video)
+        return os.path.getmtime(path) if path else ""
+
     def load_video(self, video):
-        video_path = os.path.join(input_dir,video)
+        video_path = video_index.resolve(video)
         return (video_path,)
 
 class PreviewVideo:
@@ -42,6 +58,14 @@ class PreviewVideo:
     FUNCTION = "load_video"
 
     def load_video(self, video):
+        for folder_type, folder in (("input", input_dir), ("output", output_dir)):
+            try:
+                rel = os.path.relpath(os.path.abspath(video), os.path.abspath(folder))
+            except ValueError:  # another drive
+                continue
+            if not rel.startswith(".."):
+                # keeps the subfolder, /view accepts "subfolder/name"
+                return {"ui":{"video":[rel.replace(os.sep, "/"),folder_type]}}
         video_name = os.path.basename(video)
         video_path_name = os.path.basename(os.path.dirname(video))
         return {"ui":{"video":[video_name,video_path_name]}}
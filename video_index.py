@@ -0,0 +1,224 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+VIDEO_EXTENSIONS = ("mp4", "mkv", "mov", "avi", "flv", "wmv", "webm", "m4v")
+THUMBNAIL_WIDTH = 256
+# a listing with metadata probes every file it returns, keep such pages small
+METADATA_PAGE_LIMIT = 50
+
+
+class VideoIndex:
+    """Cached listing of the videos under `root`, including subfolders.
+
+    Each directory is only listed again when its mtime changes (files added,
+    removed or renamed in it), and the whole tree is checked at most every
+    `ttl` seconds, so listing stays cheap on directories with many files.
+    Video metadata (duration, fps, resolution, frame count) is probed once per
+    file version and kept in a sqlite sidecar at `db_path`, thumbnails in
+    `thumbnail_dir`.
+    """
+
+    def __init__(self, root, db_path, thumbnail_dir, ttl=2.0):
+        self.root = root
+        self.db_path = db_path
+        self.thumbnail_dir = thumbnail_dir
+        self.ttl = ttl
+        self._dirs = {}  # relative dir -> (mtime_ns, video names, subdirs)
+        self._files = []
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = None
+
+    @classmethod
+    def from_env(cls, root):
+        db_path = os.environ.get(
+            "MINICPM_VIDEO_INDEX_DB", os.path.join(current_dir, "cache", "video_index.db")
+        )
+        thumbnail_dir = os.path.join(os.path.dirname(db_path), "video_thumbnails")
+        ttl = float(os.environ.get("MINICPM_VIDEO_INDEX_TTL", 2))
+        return cls(root, db_path, thumbnail_dir, ttl)
+
+    def files(self):
+        """Relative paths ("subfolder/name.mp4") of all videos, sorted."""
+        with self._lock:
+            if time.monotonic() - self._checked > self.ttl:
+                if self._refresh(""):
+                    self._files = sorted(self._collect(""))
+                self._checked = time.monotonic()
+            return self._files
+
+    def _refresh(self, rel_dir):
+        """Re-list the directories whose mtime changed, return whether anything did."""
+        path = os.path.join(self.root, rel_dir)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return self._dirs.pop(rel_dir, None) is not None
+        cached = self._dirs.get(rel_dir)
+        changed = cached is None or cached[0] != mtime
+        if changed:
+            videos, subdirs = [], []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    elif entry.name.rsplit(".", 1)[-1].lower() in VIDEO_EXTENSIONS:
+                        videos.append(entry.name)
+            for old in set(cached[2]) - set(subdirs) if cached else ():
+                self._forget(os.path.join(rel_dir, old))
+            self._dirs[rel_dir] = (mtime, videos, subdirs)
+        for subdir in self._dirs[rel_dir][2]:
+            changed = self._refresh(os.path.join(rel_dir, subdir)) or changed
+        return changed
+
+    def _forget(self, rel_dir):
+        for key in [k for k in self._dirs if k == rel_dir or k.startswith(rel_dir + os.sep)]:
+            del self._dirs[key]
+
+    def _collect(self, rel_dir):
+        _, videos, subdirs = self._dirs[rel_dir]
+        prefix = rel_dir.replace(os.sep, "/") + "/" if rel_dir else ""
+        for name in videos:
+            yield prefix + name
+        for subdir in subdirs:
+            yield from self._collect(os.path.join(rel_dir, subdir))
+
+    def page(self, offset=0, limit=200, subfolder="", search=""):
+        files = self.files()
+        if subfolder:
+            prefix = subfolder.strip("/") + "/"
+            files = [f for f in files if f.startswith(prefix)]
+        if search:
+            search = search.lower()
+            files = [f for f in files if search in f.lower()]
+        return {"total": len(files), "offset": offset, "files": files[offset : offset + limit]}
+
+    def resolve(self, name):
+        """Absolute path of `name`, or None if it is not a video inside the root."""
+        root = os.path.abspath(self.root)
+        path = os.path.abspath(os.path.join(root, name))
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            return None
+        return path
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS videos ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, duration REAL, "
+                "fps REAL, width INTEGER, height INTEGER, frames INTEGER)"
+            )
+        return self._conn
+
+    def metadata(self, name):
+        """Duration, fps, resolution and frame count of video `name`, probed once."""
+        path = self.resolve(name)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        with self._db_lock:
+            row = self._connect().execute(
+                "SELECT duration, fps, width, height, frames FROM videos "
+                "WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        if row is None:
+            row = self._probe(path)
+            with self._db_lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime_ns, *row),
+                )
+                conn.commit()
+        duration, fps, width, height, frames = row
+        return {
+            "name": name,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "duration": duration,
+            "fps": fps,
+            "width": width,
+            "height": height,
+            "frames": frames,
+        }
+
+    def _probe(self, path):
+        from decord import VideoReader, cpu  # pip install decord
+
+        vr = VideoReader(path, ctx=cpu(0))
+        frames = len(vr)
+        fps = vr.get_avg_fps()
+        height, width = vr[0].shape[:2]
+        return frames / fps if fps else 0.0, fps, width, height, frames
+
+    def thumbnail(self, name):
+        """Path of a JPEG thumbnail of the middle frame of video `name`, created on first use."""
+        meta = self.metadata(name)
+        if meta is None:
+            return None
+        key = hashlib.sha1(f"{name}|{meta['size']}|{meta['mtime']}".encode()).hexdigest()
+        path = os.path.join(self.thumbnail_dir, f"{key}.jpg")
+        if not os.path.exists(path):
+            from decord import VideoReader, cpu  # pip install decord
+            from PIL import Image
+
+            width = min(THUMBNAIL_WIDTH, meta["width"]) // 2 * 2
+            height = max(int(meta["height"] * width / meta["width"]) // 2 * 2, 2)
+            vr = VideoReader(self.resolve(name), ctx=cpu(0), width=width, height=height)
+            frame = vr[len(vr) // 2].asnumpy()
+            os.makedirs(self.thumbnail_dir, exist_ok=True)
+            Image.fromarray(frame).save(path + ".tmp", "JPEG", quality=85)
+            os.replace(path + ".tmp", path)
+        return path
+
+
+def register_routes(index):
+    """Serve `index` to the frontend: paginated listing, metadata and thumbnails."""
+    import asyncio
+
+    from aiohttp import web
+    from server import PromptServer
+
+    routes = PromptServer.instance.routes
+
+    async def run(fn, *args):
+        # probing and thumbnailing decode video, keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    @routes.get("/minicpm/videos")
+    async def list_videos(request):
+        query = request.rel_url.query
+        with_metadata = query.get("metadata") == "1"
+        page = await run(
+            index.page,
+            int(query.get("offset", 0)),
+            min(int(query.get("limit", 200)), METADATA_PAGE_LIMIT if with_metadata else 1000),
+            query.get("subfolder", ""),
+            query.get("search", ""),
+        )
+        if with_metadata:
+            page["files"] = await run(lambda: [index.metadata(f) for f in page["files"]])
+        return web.json_response(page)
+
+    @routes.get("/minicpm/videos/metadata")
+    async def video_metadata(request):
+        meta = await run(index.metadata, request.rel_url.query.get("filename", ""))
+        if meta is None:
+            return web.Response(status=404)
+        return web.json_response(meta)
+
+    @routes.get("/minicpm/videos/thumbnail")
+    async def video_thumbnail(request):
+        path = await run(index.thumbnail, request.rel_url.query.get("filename", ""))
+        if path is None:
+            return web.Response(status=404)
+        return web.FileResponse(path)
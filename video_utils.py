@@ -0,0 +1,272 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+from .profiling import stage, record, collect, current
+from .frame_dedup import distinct_frames, THUMBNAIL_SIZE
+
+# MiniCPM-V slices images into tiles of this size, decoding larger frames is wasted work
+SCALE_RESOLUTION = 448
+
+video_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("MINICPM_VIDEO_WORKERS", 2)),
+    thread_name_prefix="minicpm-video",
+)
+
+_frame_cache = OrderedDict()
+_frame_cache_size = int(os.environ.get("MINICPM_FRAME_CACHE_SIZE", 2))
+_frame_cache_lock = threading.Lock()
+_decodes = {}  # decodes in flight
+_decodes_lock = threading.Lock()
+
+
+def _video_reader(source_video_path, **kwargs):
+    # decord is only imported once a video is actually decoded
+    from decord import VideoReader, cpu  # pip install decord
+
+    return VideoReader(source_video_path, ctx=cpu(0), **kwargs)
+
+
+def uniform_sample(l, n):  # noqa: E741
+    gap = len(l) / n
+    idxs = [int(i * gap + gap / 2) for i in range(n)]
+    return [l[i] for i in idxs]
+
+
+def video_thumbs(source_video_path, frame_idx, size=64):
+    """Grayscale (N, size, size) thumbnails in [0, 1] of the frames `frame_idx`."""
+    vr = _video_reader(source_video_path, width=size, height=size)
+    return vr.get_batch(frame_idx).asnumpy().astype(np.float32).mean(axis=-1) / 255
+
+
+def scene_change_positions(thumbs, n):
+    """Positions of the `n` thumbnails that differ most from the previous one."""
+    scores = np.abs(np.diff(thumbs, axis=0)).mean(axis=(1, 2))
+    # the first frame is always kept, then the biggest changes
+    return sorted([0] + [int(i) + 1 for i in np.argsort(scores)[::-1][: n - 1]])
+
+
+def target_size(width, height, max_slice_nums):
+    """Largest frame size the model can use without downscaling it again."""
+    max_area = max(max_slice_nums, 1) * SCALE_RESOLUTION * SCALE_RESOLUTION
+    scale = math.sqrt(max_area / (width * height))
+    if scale >= 1:
+        return width, height
+    # decord needs even dimensions
+    return max(int(width * scale) // 2 * 2, 2), max(int(height * scale) // 2 * 2, 2)
+
+
+def encode_video(
+    source_video_path,
+    MAX_NUM_FRAMES,
+    sampling="uniform",
+    max_slice_nums=2,
+    dedup_threshold=0.0,
+    dedup_refill=True,
+):
+    """Sample up to `MAX_NUM_FRAMES` frames of a video at 1 fps as PIL images.
+
+    With `dedup_threshold` > 0, frames at least that similar to the previous
+    kept frame are dropped. With `dedup_refill` the duplicates are removed
+    from all 1 fps candidates before sampling, so the freed slots are filled
+    with frames from other timestamps; otherwise they are removed from the
+    sampled frames and the request just gets fewer frames.
+    """
+    with stage("video_decode"):
+        frames, pruned = _encode_video(
+            source_video_path,
+            MAX_NUM_FRAMES,
+            sampling,
+            max_slice_nums,
+            dedup_threshold,
+            dedup_refill,
+        )
+    record("frames_decoded", len(frames))
+    if dedup_threshold > 0:
+        record("frames_pruned", pruned)
+    return frames
+
+
+def _distinct_positions(thumbs, threshold):
+    # the 64x64 scene change thumbnails, averaged down to the dedup size
+    n, size = thumbs.shape[0], THUMBNAIL_SIZE
+    factor = thumbs.shape[1] // size
+    small = thumbs.reshape(n, size, factor, size, factor).mean(axis=(2, 4))
+    return distinct_frames(small, threshold)
+
+
+def _encode_video(
+    source_video_path, MAX_NUM_FRAMES, sampling, max_slice_nums, dedup_threshold, dedup_refill
+):
+    stat = os.stat(source_video_path)
+    cache_key = (
+        os.path.abspath(source_video_path),
+        stat.st_mtime_ns,
+        MAX_NUM_FRAMES,
+        sampling,
+        max_slice_nums,
+        dedup_threshold,
+        dedup_refill,
+    )
+    with _frame_cache_lock:
+        cached = _frame_cache.get(cache_key)
+        if cached is not None:
+            _frame_cache.move_to_end(cache_key)
+            print("num frames:", len(cached[0]), "(cached)")
+            return cached
+
+    vr = _video_reader(source_video_path)
+    total_frames = len(vr) + 1
+    print("Total frames:", total_frames)
+    avg_fps = vr.get_avg_fps()
+    print("Get average FPS(frame per second):", avg_fps)
+    sample_fps = max(round(avg_fps / 1), 1)  # FPS
+    duration = len(vr) / avg_fps
+    print("Total duration:", duration, "seconds")
+    height, width = vr[0].shape[:2]
+    print("Video resolution(width x height):", width, "x", height)
+
+    frame_idx = [i for i in range(0, len(vr), sample_fps)]
+    # thumbnails of `frame_idx` for dedup and scene change, decoded at most once
+    thumbs = None
+    pruned = 0
+    dedup = dedup_threshold > 0 and len(frame_idx) > 1
+    if dedup and dedup_refill:
+        thumbs = video_thumbs(source_video_path, frame_idx)
+        keep = _distinct_positions(thumbs, dedup_threshold)
+        pruned = len(frame_idx) - len(keep)
+        frame_idx, thumbs = [frame_idx[i] for i in keep], thumbs[keep]
+    if len(frame_idx) > MAX_NUM_FRAMES:
+        if sampling == "scene_change":
+            if thumbs is None:
+                thumbs = video_thumbs(source_video_path, frame_idx)
+            keep = scene_change_positions(thumbs, MAX_NUM_FRAMES)
+        else:
+            keep = uniform_sample(range(len(frame_idx)), MAX_NUM_FRAMES)
+        frame_idx = [frame_idx[i] for i in keep]
+        if thumbs is not None:
+            thumbs = thumbs[keep]
+    if dedup and not dedup_refill and len(frame_idx) > 1:
+        if thumbs is None:
+            thumbs = video_thumbs(source_video_path, frame_idx)
+        keep = _distinct_positions(thumbs, dedup_threshold)
+        pruned = len(frame_idx) - len(keep)
+        frame_idx = [frame_idx[i] for i in keep]
+    if pruned:
+        print("Pruned near-duplicate frames:", pruned)
+
+    decode_width, decode_height = target_size(width, height, max_slice_nums)
+    if (decode_width, decode_height) != (width, height):
+        print("Decoding at(width x height):", decode_width, "x", decode_height)
+        vr = _video_reader(
+            source_video_path, width=decode_width, height=decode_height
+        )
+    frames = vr.get_batch(frame_idx).asnumpy()
+    frames = [Image.fromarray(v) for v in frames]
+    print("num frames:", len(frames))
+
+    with _frame_cache_lock:
+        _frame_cache[cache_key] = (frames, pruned)
+        while len(_frame_cache) > _frame_cache_size:
+            _frame_cache.popitem(last=False)
+    return frames, pruned
+
+
+def submit_encode_video(
+    source_video_path,
+    MAX_NUM_FRAMES,
+    sampling="uniform",
+    max_slice_nums=2,
+    dedup_threshold=0.0,
+    dedup_refill=True,
+    bind_metrics=True,
+):
+    """Decode on the worker pool so it overlaps with model loading.
+
+    A request for a video that is still being decoded, e.g. by a prefetch of
+    the next queued prompt, shares that decode. The decode records into its
+    own metrics, which `result()` adds to the caller's run when
+    `bind_metrics` (prefetches pass False, they belong to no run yet).
+    """
+    params = (MAX_NUM_FRAMES, sampling, max_slice_nums, dedup_threshold, dedup_refill)
+    key = (os.path.abspath(source_video_path), *params)
+    with _decodes_lock:
+        future = _decodes.get(key)
+        if future is None:
+            future = video_pool.submit(_collect_encode_video, source_video_path, *params)
+            _decodes[key] = future
+            future.add_done_callback(lambda f: _decode_done(key, f))
+    return VideoDecode(future, current() if bind_metrics else None)
+
+
+def _collect_encode_video(*args):
+    with collect() as metrics:
+        frames = encode_video(*args)
+    return frames, metrics
+
+
+class VideoDecode:
+    """A caller's handle on a possibly shared decode."""
+
+    def __init__(self, future, metrics):
+        self.future = future
+        self.metrics = metrics
+
+    def result(self):
+        frames, decode_metrics = self.future.result()
+        if self.metrics is not None:
+            self.metrics.merge(decode_metrics)
+            self.metrics = None  # merge once
+        return frames
+
+
+def _decode_done(key, future):
+    with _decodes_lock:
+        if _decodes.get(key) is future:
+            del _decodes[key]
+
+
+def open_video_windows(source_video_path, window_seconds, max_frames_per_window, max_slice_nums=2):
+    """Split a video into consecutive windows for chunked processing.
+
+    Returns a reader decoding at model resolution and a list of
+    `(start_seconds, end_seconds, frame_idx)`, one per window, each sampled at
+    1 fps and capped at `max_frames_per_window` frames.
+    """
+    vr = _video_reader(source_video_path)
+    avg_fps = vr.get_avg_fps()
+    total_frames = len(vr)
+    height, width = vr[0].shape[:2]
+    decode_width, decode_height = target_size(width, height, max_slice_nums)
+    if (decode_width, decode_height) != (width, height):
+        vr = _video_reader(
+            source_video_path, width=decode_width, height=decode_height
+        )
+
+    sample_fps = max(round(avg_fps / 1), 1)  # FPS
+    window = max(int(round(window_seconds * avg_fps)), 1)
+    windows = []
+    for start in range(0, total_frames, window):
+        end = min(start + window, total_frames)
+        frame_idx = [i for i in range(start, end, sample_fps)]
+        if len(frame_idx) > max_frames_per_window:
+            frame_idx = uniform_sample(frame_idx, max_frames_per_window)
+        windows.append((start / avg_fps, end / avg_fps, frame_idx))
+    print("Total duration:", total_frames / avg_fps, "seconds,", len(windows), "windows")
+    return vr, windows
+
+
+def decode_frames(vr, frame_idx):
+    return [Image.fromarray(v) for v in vr.get_batch(frame_idx).asnumpy()]
+
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
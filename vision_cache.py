@@ -0,0 +1,159 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+from .profiling import record
+
+
+def vision_key(model_checkpoint, images, max_slice_nums):
+    """Key of the vision embeddings of `images` (PIL) sliced with `max_slice_nums`."""
+    if not images:
+        return None
+    h = hashlib.sha256(f"{model_checkpoint}|{max_slice_nums}".encode())
+    for image in images:
+        h.update(f"|{image.mode}{image.size}|".encode())
+        h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def _tensor_bytes(tensor):
+    return tensor.numel() * tensor.element_size()
+
+
+class VisionEmbeddingCache:
+    """LRU cache of post-resampler image embeddings (`vision_hidden_states`).
+
+    A hit lets `model.chat` skip the vision tower entirely and only run the
+    language model. Embeddings are kept on the CPU, bounded by `max_bytes`, and
+    optionally persisted to `disk_dir` so they survive a restart, least
+    recently used files first removed beyond `max_disk_bytes`.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, max_disk_bytes=4 * 1024**3):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disk = None  # key -> file size, least recently used first
+        self._disk_size = 0
+        self._disk_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        max_mb = float(os.environ.get("MINICPM_VISION_CACHE_MB", 512))
+        disk_mb = float(os.environ.get("MINICPM_VISION_CACHE_DISK_MB", 4096))
+        return cls(
+            int(max_mb * 1024**2),
+            os.environ.get("MINICPM_VISION_CACHE_DIR"),
+            int(disk_mb * 1024**2),
+        )
+
+    def _disk_index(self):
+        # built once from the files left by earlier runs, oldest access first
+        if self._disk is None:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            files = []
+            with os.scandir(self.disk_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".pt"):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, entry.name[: -len(".pt")], stat.st_size))
+            self._disk = OrderedDict((key, size) for _, key, size in sorted(files))
+            self._disk_size = sum(self._disk.values())
+        return self._disk
+
+    def get(self, key):
+        with self._lock:
+            hidden_states = self._entries.get(key)
+            if hidden_states is not None:
+                self._entries.move_to_end(key)
+        if hidden_states is None and self.disk_dir:
+            path = os.path.join(self.disk_dir, f"{key}.pt")
+            with self._disk_lock:
+                on_disk = key in self._disk_index()
+                if on_disk:
+                    self._disk.move_to_end(key)
+            if on_disk and os.path.exists(path):
+                hidden_states = torch.load(path, map_location="cpu", weights_only=True)
+                os.utime(path)  # the file mtime is the access time across restarts
+                self._store(key, hidden_states)
+        if hidden_states is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return hidden_states
+
+    def put(self, key, hidden_states):
+        hidden_states = hidden_states.detach().cpu()
+        self._store(key, hidden_states)
+        if self.disk_dir:
+            self._save(key, hidden_states)
+
+    def _save(self, key, hidden_states):
+        path = os.path.join(self.disk_dir, f"{key}.pt")
+        with self._disk_lock:
+            disk = self._disk_index()
+            torch.save(hidden_states, path + ".tmp")
+            os.replace(path + ".tmp", path)
+            self._disk_size += os.path.getsize(path) - disk.pop(key, 0)
+            disk[key] = os.path.getsize(path)
+            while self._disk_size > self.max_disk_bytes and len(disk) > 1:
+                old_key, old_size = disk.popitem(last=False)
+                self._disk_size -= old_size
+                try:
+                    os.remove(os.path.join(self.disk_dir, f"{old_key}.pt"))
+                except OSError:
+                    pass
+
+    def _store(self, key, hidden_states):
+        size = _tensor_bytes(hidden_states)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= _tensor_bytes(self._entries.pop(key))
+            self._entries[key] = hidden_states
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= _tensor_bytes(evicted)
+
+    @contextmanager
+    def reuse(self, model, key):
+        """Yield extra `model.chat` kwargs that reuse or record the embeddings of `key`."""
+        if key is None:
+            yield {}
+            return
+
+        hidden_states = self.get(key)
+        record("vision_cache", "miss" if hidden_states is None else "hit")
+        if hidden_states is not None:
+            hidden_states = hidden_states.to(model.device, model.dtype)
+            yield {"vision_hidden_states": [hidden_states]}
+            return
+
+        captured = []
+        get_vllm_embedding = model.get_vllm_embedding
+
+        def capture_vllm_embedding(data):
+            vllm_embedding, vision_hidden_states = get_vllm_embedding(data)
+            captured.append(vision_hidden_states)
+            return vllm_embedding, vision_hidden_states
+
+        model.get_vllm_embedding = capture_vllm_embedding
+        try:
+            yield {}
+        finally:
+            del model.get_vllm_embedding  # drop the instance override
+        if captured and torch.is_tensor(captured[0][0]):
+            self.put(key, captured[0][0])
+
+
+vision_cache = VisionEmbeddingCache.from_env()
@@ -0,0 +1,293 @@
+from contextlib import contextmanager
+
+import torch
+from .model_registry import registry, load_settings, DEVICE_MODES
+from .image_preprocess import model_images
+from .response_cache import response_cache, response_key
+from .vision_cache import vision_cache, vision_key
+from .generation_utils import frontend_streamer
+from .speculative import assisted_chat, DECODING_MODES
+from .memory_budget import run_with_budget, BUDGET_MODES
+from .video_utils import submit_encode_video
+from .frame_dedup import dedup_image_batches
+from .queue_prefetch import prefetch_queued_videos
+from .profiling import stage, record, node_run, node_output
+
+
+def sampling_input_types(max_new_tokens=2048):
+    """The sampling widgets of every MiniCPM node, in widget order."""
+    return {
+        "top_p": (
+            "FLOAT",
+            {
+                "default": 0.8,
+            },
+        ),
+        "top_k": (
+            "INT",
+            {
+                "default": 100,
+            },
+        ),
+        "temperature": (
+            "FLOAT",
+            {"default": 0.7, "min": 0, "max": 1, "step": 0.1},
+        ),
+        "repetition_penalty": (
+            "FLOAT",
+            {
+                "default": 1.05,
+            },
+        ),
+        "max_new_tokens": (
+            "INT",
+            {
+                "default": max_new_tokens,
+            },
+        ),
+    }
+
+
+def sampling_kwargs(top_p, top_k, temperature, repetition_penalty, max_new_tokens):
+    """`model.chat` sampling kwargs from the widgets of `sampling_input_types`."""
+    return {
+        "top_k": top_k,
+        "top_p": top_p,
+        "temperature": temperature,
+        "repetition_penalty": repetition_penalty,
+        "max_new_tokens": max_new_tokens,
+    }
+
+
+@contextmanager
+def acquired_model(node, model, device_mode, keep_model_loaded, park_on_cpu):
+    """Hold the shared registry entry of `model` for the block, sets `node.model_checkpoint`.
+
+    On exit the entry is released; the registry unloads or parks the model
+    once no node needs it anymore.
+    """
+    node.model_checkpoint, torch_dtype, device_mode = load_settings(model, device_mode)
+    model_entry = registry.acquire(
+        node.model_checkpoint,
+        torch_dtype,
+        attn_implementation="sdpa",
+        device_mode=device_mode,
+    )
+    try:
+        yield model_entry
+    finally:
+        with stage("teardown"):
+            registry.release(model_entry, keep_loaded=keep_model_loaded, park=park_on_cpu)
+
+
+def vqa_input_types(image_inputs):
+    """INPUT_TYPES of a VQA node taking the optional image sockets `image_inputs`."""
+    return {
+        "required": {
+            "text": ("STRING", {"default": "", "multiline": True}),
+            "model": (
+                ["MiniCPM-V-2_6-int4", "MiniCPM-Llama3-V-2_5-int4"],
+                {"default": "MiniCPM-V-2_6-int4"},
+            ),
+            "keep_model_loaded": ("BOOLEAN", {"default": False}),
+            **sampling_input_types(),
+            "video_max_num_frames": (
+                "INT",
+                {
+                    "default": 64,
+                },
+            ),  # if cuda OOM set a smaller number
+            "video_max_slice_nums": (
+                "INT",
+                {
+                    "default": 2,
+                },
+            ),  # use 1 if cuda OOM and video resolution >  448*448
+            "seed": ("INT", {"default": -1}),  # add seed parameter, default is -1
+        },
+        "optional": {
+            "source_video_path": ("PATH",),
+            **image_inputs,
+            "video_sampling": (["uniform", "scene_change"], {"default": "uniform"}),
+            "image_preprocess": (["tensor", "tensor_gpu", "pil"], {"default": "tensor"}),
+            "device_mode": (DEVICE_MODES, {"default": "auto"}),
+            "park_on_cpu": ("BOOLEAN", {"default": False}),
+            "stream": ("BOOLEAN", {"default": False}),
+            "stop_string": ("STRING", {"default": ""}),
+            "decoding": (DECODING_MODES, {"default": "default"}),
+            "budget": (BUDGET_MODES, {"default": "fixed"}),
+            "system_prompt": ("STRING", {"default": "", "multiline": True}),
+            # drop frames/images at least this similar to a kept one, 0 disables
+            "dedup_threshold": ("FLOAT", {"default": 0.0, "min": 0, "max": 1, "step": 0.01}),
+            "dedup_refill": ("BOOLEAN", {"default": True}),
+        },
+        "hidden": {"unique_id": "UNIQUE_ID"},
+    }
+
+
+class VQANode:
+    """Shared inference core of the VQA nodes.
+
+    Subclasses declare their image sockets and map them to a list of IMAGE
+    batches in `answer`; loading, preprocessing, generation and teardown all
+    happen in `vqa`, so both nodes get every optimization at once.
+    """
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("STRING", "metrics")
+    FUNCTION = "inference"
+    CATEGORY = "Comfyui_MiniCPM-V-2_6-int4"
+
+    def __init__(self):
+        self.model_checkpoint = None
+
+    def inference(self, **kwargs):
+        # timings and counters go to the UI, the `metrics` output and the metrics log
+        with node_run(type(self).__name__) as run:
+            result = self.answer(**kwargs)
+        return node_output(run, result)
+
+    def vqa(
+        self,
+        text,
+        model,
+        keep_model_loaded,
+        top_p,
+        top_k,
+        temperature,
+        repetition_penalty,
+        max_new_tokens,
+        video_max_num_frames,
+        video_max_slice_nums,
+        seed,
+        image_batches=(),
+        source_video_path=None,
+        video_sampling="uniform",
+        image_preprocess="tensor",
+        device_mode="auto",
+        park_on_cpu=False,
+        stream=False,
+        stop_string="",
+        decoding="default",
+        budget="fixed",
+        system_prompt="",
+        dedup_threshold=0.0,
+        dedup_refill=True,
+        unique_id=None,
+    ):
+        """Answer `text` about a video or every image of `image_batches`, in order."""
+        cache_key = None
+        if seed != -1:
+            torch.manual_seed(seed)
+            # deterministic request: reuse the stored answer if we have one
+            cache_key = response_key(
+                model,
+                text,
+                images=image_batches,
+                video_path=source_video_path,
+                top_p=top_p,
+                top_k=top_k,
+                temperature=temperature,
+                repetition_penalty=repetition_penalty,
+                max_new_tokens=max_new_tokens,
+                video_max_num_frames=video_max_num_frames,
+                video_max_slice_nums=video_max_slice_nums,
+                video_sampling=video_sampling,
+                # tensor and PIL preprocessing resample differently
+                image_preprocess=image_preprocess,
+                device_mode=device_mode,
+                stop_string=stop_string,
+                decoding=decoding,
+                budget=budget,
+                system_prompt=system_prompt,
+                dedup_threshold=dedup_threshold,
+                dedup_refill=dedup_refill,
+                seed=seed,
+            )
+            result = response_cache.get(cache_key)
+            record("response_cache", "miss" if result is None else "hit")
+            if result is not None:
+                return result
+
+        video_frames = None
+        if source_video_path:
+            print("source_video_path:", source_video_path)
+            # decode on a worker thread while the model is being loaded
+            video_frames = submit_encode_video(
+                source_video_path,
+                video_max_num_frames,
+                video_sampling,
+                video_max_slice_nums,
+                dedup_threshold,
+                dedup_refill,
+            )
+
+        with acquired_model(
+            self, model, device_mode, keep_model_loaded, park_on_cpu
+        ) as model_entry:
+            with torch.no_grad(), stage("preprocess"):
+                if video_frames is not None:
+                    frames = video_frames.result()
+                    msgs = [{"role": "user", "content": frames + [text]}]
+                elif image_batches:
+                    if dedup_threshold > 0:
+                        image_batches, pruned = dedup_image_batches(image_batches, dedup_threshold)
+                        record("frames_pruned", pruned)
+                    # every image of every batch, each batch keeps its own size
+                    images = [
+                        image
+                        for batch in image_batches
+                        for image in model_images(
+                            model_entry.model,
+                            self.model_checkpoint,
+                            batch,
+                            image_preprocess,
+                        )
+                    ]
+                    msgs = [{"role": "user", "content": images + [text]}]
+                else:
+                    msgs = [{"role": "user", "content": [text]}]
+                    # raise ValueError("Either image or video must be provided")
+
+            def generate(msgs, max_slice_nums):
+                with torch.no_grad():
+                    params = {"use_image_id": False, "max_slice_nums": max_slice_nums}
+
+                    # follow-up questions about an already seen image skip the vision tower
+                    images = [c for c in msgs[0]["content"] if not isinstance(c, str)]
+                    embedding_key = vision_key(self.model_checkpoint, images, max_slice_nums)
+                    with vision_cache.reuse(model_entry.model, embedding_key) as cached:
+                        return assisted_chat(
+                            model_entry.model,
+                            model_entry.tokenizer,
+                            msgs,
+                            decoding,
+                            self.model_checkpoint,
+                            stream=stream,
+                            stop_string=stop_string,
+                            on_text=frontend_streamer(unique_id) if stream else None,
+                            system_prompt=system_prompt,
+                            **sampling_kwargs(
+                                top_p, top_k, temperature, repetition_penalty, max_new_tokens
+                            ),
+                            **cached,
+                            **params,
+                        )
+
+            # decode the next queued prompt's video on the CPU while this one generates
+            prefetch_queued_videos()
+            # in auto mode the frame and slice counts are upper bounds fitted to free memory
+            result = run_with_budget(
+                model_entry.model,
+                model_entry.tokenizer,
+                msgs,
+                video_max_slice_nums,
+                max_new_tokens,
+                generate,
+                auto=budget == "auto",
+                droppable=video_frames is not None,
+            )
+
+        if cache_key is not None:
+            response_cache.put(cache_key, result)
+        return result
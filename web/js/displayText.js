@@ -1,5 +1,6 @@
 import { app } from "/scripts/app.js";
 import { ComfyWidgets } from "/scripts/widgets.js";
+import { api } from "/scripts/api.js";
 
 app.registerExtension({
 	name: "Comfyui_MiniCPM-V-2_6-int4.DisplayTextNode",
@@ -37,6 +38,22 @@ app.registerExtension({
 				});
 			}
 
+			// new text streamed by the VQA node feeding this DisplayText, appended after the first piece
+			api.addEventListener("minicpm.stream", ({ detail }) => {
+				for (const node of app.graph._nodes) {
+					if (node.type !== "DisplayText" || String(node.getInputNode(0)?.id) !== String(detail.node)) {
+						continue;
+					}
+					const w = node.widgets?.findLast((w) => w.name === "text" && w.inputEl);
+					if (w) {
+						w.value = detail.append ? w.value + detail.text : detail.text;
+						w.inputEl.scrollTop = w.inputEl.scrollHeight;
+					} else {
+						populate.call(node, [detail.text]);
+					}
+				}
+			});
+
 			const onExecuted = nodeType.prototype.onExecuted;
 			nodeType.prototype.onExecuted = function (message) {
 				onExecuted?.apply(this, arguments);
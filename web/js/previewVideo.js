@@ -135,6 +135,9 @@ function previewVideo(node,file,type){
         params.force_size = target_width+"x"+(target_width/ar)
     }
     
+    if (type === "input") {
+        previewWidget.videoEl.poster = api.apiURL('/minicpm/videos/thumbnail?' + new URLSearchParams({"filename": file}));
+    }
     previewWidget.videoEl.src = api.apiURL('/view?' + new URLSearchParams(params));
 
     previewWidget.videoEl.hidden = false;
@@ -0,0 +1,71 @@
+import { app } from "/scripts/app.js";
+import { ComfyWidgets } from "/scripts/widgets.js";
+
+const VQA_NODES = ["MiniCPM_VQA", "MiniCPM_VQA_Polished"];
+
+function formatMetrics(m) {
+	const s = m.stages || {};
+	const parts = [`total ${m.total}s`];
+	for (const [name, seconds] of Object.entries(s)) {
+		parts.push(`${name} ${seconds}s`);
+	}
+	for (const key of ["model_cache", "response_cache", "vision_cache", "prefix_cache"]) {
+		if (m[key]) {
+			parts.push(`${key} ${m[key]}`);
+		}
+	}
+	if (m.frames_decoded !== undefined) {
+		parts.push(`${m.frames_decoded} frames`);
+	}
+	if (m.frames_pruned) {
+		parts.push(`${m.frames_pruned} near-duplicate frames pruned`);
+	}
+	if (m.budget_images !== undefined) {
+		parts.push(`budget ${m.budget_images} images x ${m.budget_max_slice_nums} slices`);
+	}
+	if (m.oom_retries) {
+		parts.push(`${m.oom_retries} OOM retries`);
+	}
+	if (m.prompt_tokens !== undefined) {
+		parts.push(`${m.prompt_tokens} prompt tokens`);
+	}
+	if (m.generated_tokens !== undefined) {
+		parts.push(`${m.generated_tokens} generated tokens`);
+	}
+	if (m.tokens_per_second !== undefined) {
+		parts.push(`${m.tokens_per_second} tokens/s`);
+	}
+	if (m.acceptance_rate !== undefined) {
+		parts.push(`${m.decoding} acceptance ${m.acceptance_rate}`);
+	}
+	if (m.peak_vram_mb !== undefined) {
+		parts.push(`peak VRAM ${m.peak_vram_mb} MB`);
+	}
+	return parts.join("\n");
+}
+
+app.registerExtension({
+	name: "Comfyui_MiniCPM-V-2_6-int4.RunMetrics",
+	async beforeRegisterNodeDef(nodeType, nodeData, app) {
+		if (!VQA_NODES.includes(nodeData.name)) {
+			return;
+		}
+		const onExecuted = nodeType.prototype.onExecuted;
+		nodeType.prototype.onExecuted = function (message) {
+			onExecuted?.apply(this, arguments);
+			if (!message?.metrics?.length) {
+				return;
+			}
+			let w = this.widgets?.find((w) => w.name === "run_metrics");
+			if (!w) {
+				w = ComfyWidgets["STRING"](this, "run_metrics", ["STRING", { multiline: true }], app).widget;
+				w.inputEl.readOnly = true;
+				w.inputEl.style.opacity = 0.6;
+				// display only, not sent with the prompt
+				w.options = { ...w.options, serialize: false };
+			}
+			w.value = formatMetrics(message.metrics[0]);
+			app.graph.setDirtyCanvas(true, false);
+		};
+	},
+});
@@ -82,12 +82,52 @@ function previewVideo(node,file){
         params.force_size = target_width+"x"+(target_width/ar)
     }
     
+    previewWidget.videoEl.poster = api.apiURL('/minicpm/videos/thumbnail?' + new URLSearchParams({"filename": file}));
     previewWidget.videoEl.src = api.apiURL('/view?' + new URLSearchParams(params));
 
     previewWidget.videoEl.hidden = false;
     previewWidget.parentEl.appendChild(previewWidget.videoEl)
 }
 
+// one listing shared by every LoadVideo node, fetched again once it is this old
+const VIDEO_LIST_TTL = 30000;
+let videoList = null;
+
+function fetchVideoList() {
+    if (videoList && Date.now() - videoList.time < VIDEO_LIST_TTL) {
+        return videoList.values;
+    }
+    const values = (async () => {
+        // the node definition carries no file list, page it in from the video index
+        const values = [];
+        for (let offset = 0; ; ) {
+            const resp = await api.fetchApi("/minicpm/videos?" + new URLSearchParams({"offset": offset, "limit": 1000}));
+            if (resp.status !== 200) {
+                break;
+            }
+            const page = await resp.json();
+            values.push(...page.files);
+            offset += page.files.length;
+            if (!page.files.length || offset >= page.total) {
+                break;
+            }
+        }
+        return values;
+    })();
+    videoList = {time: Date.now(), values: values};
+    return values;
+}
+
+async function loadVideoList(node, videoWidget) {
+    // nodes created together (e.g. by loading a workflow) share one request and one array
+    const values = await fetchVideoList();
+    videoWidget.options.values = values;
+    if (!videoWidget.value && values.length) {
+        videoWidget.value = values[0];
+        previewVideo(node, videoWidget.value);
+    }
+}
+
 function videoUpload(node, inputName, inputData, app) {
     const videoWidget = node.widgets.find((w) => w.name === "video");
     let uploadWidget;
@@ -178,6 +218,7 @@ function videoUpload(node, inputName, inputData, app) {
     uploadWidget.serialize = false;
 
     previewVideo(node, videoWidget.value);
+    loadVideoList(node, videoWidget);
     const cb = node.callback;
     videoWidget.callback = function () {
         previewVideo(node,videoWidget.value);